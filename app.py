@@ -2,8 +2,18 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
-from config import Config
+from config import Config, engine_options, replica_binds
 from models import db, User, Farm, Variety, Inventory
+from models.cache import variety_cache
+from models.variety import variety_names
+import pool_metrics
+import profiling
+from json_provider import provider_class
+import commands
+import single_flight
+import auth
+import change_feed
+import replicas
 
 # Initialize Flask extensions
 migrate = Migrate()
@@ -11,15 +21,31 @@ migrate = Migrate()
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **replica_binds(app.config))
+    app.json = provider_class(app.config['JSON_PROVIDER'])(app)
 
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
-    CORS(app)
+    CORS(app, expose_headers=[replicas.HEADER])
+    pool_metrics.init_app(app, db)
+    profiling.init_app(app, db)
+    single_flight.init_app(app)
+    change_feed.init_app(app)
+    replicas.init_app(app)
+    commands.init_app(app)
+    variety_cache.configure(
+        ttl=app.config['VARIETY_CACHE_TTL'],
+        maxsize=app.config['VARIETY_CACHE_SIZE'],
+        version_interval=app.config['VARIETY_CACHE_VERSION_INTERVAL']
+    )
+    variety_names.configure(app.config['VARIETY_CACHE_VERSION_INTERVAL'])
 
     # Register blueprints
     from routes.main import main
     app.register_blueprint(main)
+    auth.init_app(app, main.name)
 
     return app
 
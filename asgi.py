@@ -0,0 +1,182 @@
+import asyncio
+import io
+import sys
+from sqlalchemy.util import await_only, greenlet_spawn
+from app import create_app
+from config import Config
+from models import db
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql'
+}
+
+
+def async_database_uri(uri):
+    """Swap the driver of a database URL for its asyncio counterpart"""
+    scheme, separator, rest = uri.partition('://')
+    backend = scheme.split('+', 1)[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('No async driver known for %s' % backend)
+    return ASYNC_DRIVERS[backend] + separator + rest
+
+
+class _ClientMessages:
+    """Reads ASGI receive() in a background task, so a disconnect is noticed while a response streams"""
+
+    def __init__(self, receive):
+        self.disconnected = False
+        self._messages = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._read(receive))
+
+    async def _read(self, receive):
+        while not self.disconnected:
+            message = await receive()
+            self.disconnected = message['type'] == 'http.disconnect'
+            self._messages.put_nowait(message)
+
+    async def receive(self):
+        return await self._messages.get()
+
+    def close(self):
+        self._task.cancel()
+
+
+class _ASGIInput(io.RawIOBase):
+    """Request body read from ASGI receive() as the WSGI app consumes it"""
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.pending = b''
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and self.more_body:
+            message = await_only(self.receive())
+            if message['type'] == 'http.disconnect':
+                self.more_body = False
+                break
+            self.pending = message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def wsgi_environ(scope, stream):
+    """Build a WSGI environ for an ASGI HTTP scope"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': stream,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+class AsyncEngineApp:
+    """ASGI application serving a Flask app whose engine uses an asyncio driver
+
+    Each request runs the unchanged Flask views and models in a greenlet, so
+    every statement awaits the driver on the event loop instead of blocking a
+    thread; one worker then holds many slow queries at once.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            client = _ClientMessages(receive)
+            try:
+                await greenlet_spawn(self._handle, scope, client, send)
+            finally:
+                client.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await greenlet_spawn(self._dispose)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _dispose(self):
+        with self.flask_app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+    def _handle(self, scope, client, send):
+        environ = wsgi_environ(scope, io.BufferedReader(_ASGIInput(client.receive)))
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def start():
+            await_only(send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']}))
+
+        body = self.flask_app(environ, start_response)
+        try:
+            started = False
+            # Streamed bodies are produced lazily, so their queries also run here
+            for chunk in body:
+                # The server drops writes to a gone client, so an endless stream must be closed here
+                if client.disconnected:
+                    return
+                if not chunk:
+                    continue
+                if not started:
+                    start()
+                    started = True
+                await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+            if not started:
+                start()
+            await_only(send({'type': 'http.response.body', 'body': b''}))
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+def create_asgi_app(config_class=Config):
+    """Create the app for an ASGI server, on ASYNC_DATABASE_URL or the async twin of DATABASE_URL
+
+    Serve it with e.g. uvicorn asgi:create_asgi_app --factory; the driver
+    (asyncpg, aiosqlite or aiomysql) must be installed.
+    """
+    class AsyncConfig(config_class):
+        SQLALCHEMY_DATABASE_URI = config_class.ASYNC_DATABASE_URL or async_database_uri(config_class.SQLALCHEMY_DATABASE_URI)
+        DATABASE_REPLICA_URLS = [async_database_uri(url) for url in config_class.DATABASE_REPLICA_URLS]
+        # Requests share a thread here, so a waiter blocking on a thread event would stall the leader
+        SINGLE_FLIGHT = False
+
+    return AsyncEngineApp(create_app(AsyncConfig))
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from flask import current_app, g, jsonify, request
+from werkzeug.utils import import_string
+
+try:
+    import jwt
+except ImportError:  # only needed when FIREBASE_AUTH is on
+    jwt = None
+
+GOOGLE_KEYS_URL = 'https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com'
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class AuthError(Exception):
+    """Raised when a request's ID token is missing or does not verify"""
+
+
+class KeysUnavailable(Exception):
+    """Raised when the signing keys cannot be fetched and none are cached"""
+
+
+class KeySource:
+    """Caches a JWKS and refetches it when it expires or an unknown key ID shows up
+
+    Subclasses implement fetch(), returning (jwks, max_age) where max_age is
+    the number of seconds the set may be cached, or None for no expiry.
+    """
+
+    def __init__(self, min_refresh_interval=60):
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        raise NotImplementedError
+
+    def get_key(self, kid):
+        """Get the public key for a key ID, or None if the source does not have it"""
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            return key
+        with self._lock:
+            key = self._keys.get(kid)
+            if key is not None and now < self._expires_at:
+                return key
+            # A new kid usually means the keys rotated, but do not let
+            # tokens with made-up kids trigger a fetch per request
+            recently = self._fetched_at is not None and now - self._fetched_at < self.min_refresh_interval
+            if key is None and recently:
+                if not self._keys:
+                    raise KeysUnavailable('No signing keys have been fetched yet')
+                return None
+            if key is None or now >= self._expires_at:
+                self._load(now)
+            return self._keys.get(kid)
+
+    def _load(self, now):
+        try:
+            jwks, max_age = self.fetch()
+            keys = {
+                jwk['kid']: jwt.PyJWK(jwk, algorithm='RS256').key
+                for jwk in jwks.get('keys', []) if 'kid' in jwk
+            }
+        except (OSError, ValueError, jwt.PyJWTError) as e:
+            # Whether a fetch failed or returned a bad key set, try again a
+            # little later, serving the keys we have until then
+            self._fetched_at = now
+            if not self._keys:
+                raise KeysUnavailable(str(e)) from e
+            self._expires_at = now + self.min_refresh_interval
+            return
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + max_age if max_age is not None else float('inf')
+
+
+class HTTPKeySource(KeySource):
+    """Fetches a JWKS over HTTP, caching it for as long as Cache-Control allows"""
+
+    def __init__(self, url=GOOGLE_KEYS_URL, timeout=5, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.load(response)
+            match = _MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        return jwks, int(match.group(1)) if match else 3600
+
+
+class FileKeySource(KeySource):
+    """Reads a JWKS from a local file, for tests and offline development"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def fetch(self):
+        with open(self.path) as f:
+            return json.load(f), None
+
+
+class StaticKeySource(KeySource):
+    """Serves an in-memory JWKS dict"""
+
+    def __init__(self, jwks, min_refresh_interval=0, **kwargs):
+        super().__init__(min_refresh_interval=min_refresh_interval, **kwargs)
+        self.jwks = jwks
+
+    def fetch(self):
+        return self.jwks, None
+
+
+def key_source(name):
+    """Resolve FIREBASE_KEYS: an http(s) JWKS URL, a JWKS file path or 'import:' plus a callable's path"""
+    if name.startswith('import:'):
+        return import_string(name[len('import:'):])()
+    if name.startswith(('http://', 'https://')):
+        return HTTPKeySource(name)
+    return FileKeySource(name)
+
+
+class TokenVerifier:
+    """Verifies Firebase ID tokens and remembers verified claims until the token expires"""
+
+    def __init__(self, project_id, keys, cache_size=10000, leeway=5):
+        self.project_id = project_id
+        self.keys = keys
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """Get the claims of a valid token, raising AuthError otherwise"""
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._claims.get(digest)
+            if cached is not None:
+                if now < cached['exp'] + self.leeway:
+                    self._claims.move_to_end(digest)
+                    return cached
+                del self._claims[digest]
+
+        claims = self._decode(token)
+        if self.cache_size:
+            with self._lock:
+                self._claims[digest] = claims
+                self._claims.move_to_end(digest)
+                while len(self._claims) > self.cache_size:
+                    self._claims.popitem(last=False)
+        return claims
+
+    def _decode(self, token):
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            raise AuthError('Malformed token')
+        if header.get('alg') != 'RS256':
+            raise AuthError('Unexpected token algorithm')
+        key = self.keys.get_key(header.get('kid'))
+        if key is None:
+            raise AuthError('Unknown signing key')
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=['RS256'],
+                audience=self.project_id,
+                issuer='https://securetoken.google.com/%s' % self.project_id,
+                leeway=self.leeway,
+                options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']}
+            )
+        except jwt.InvalidTokenError as e:
+            raise AuthError(str(e))
+        if not claims['sub'] or len(claims['sub']) > 128:
+            raise AuthError('Invalid subject')
+        if claims.get('auth_time', 0) > time.time() + self.leeway:
+            raise AuthError('Authentication time is in the future')
+        return claims
+
+
+def authenticate():
+    """Require a valid Firebase ID token; stores its claims in g.firebase_claims"""
+    if request.method == 'OPTIONS':
+        return None  # CORS preflight carries no credentials
+    verifier = current_app.extensions['firebase_auth']
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    try:
+        if scheme.lower() != 'bearer' or not token:
+            raise AuthError('Missing bearer token')
+        claims = verifier.verify(token.strip())
+    except AuthError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+        return response, 401
+    except KeysUnavailable:
+        current_app.logger.exception('Could not load the Firebase signing keys')
+        return jsonify({'error': 'Token verification is unavailable'}), 503
+    g.firebase_claims = claims
+    g.firebase_uid = claims['sub']
+    return None
+
+
+def init_app(app, blueprint='main', keys=None):
+    """Require Firebase ID tokens on a blueprint's routes when FIREBASE_AUTH is set
+
+    keys overrides the FIREBASE_KEYS key source, e.g. with a StaticKeySource.
+    """
+    if not app.config['FIREBASE_AUTH']:
+        return
+    if jwt is None:
+        raise RuntimeError('FIREBASE_AUTH is on but PyJWT is not installed')
+    if not app.config['FIREBASE_PROJECT_ID']:
+        raise RuntimeError('FIREBASE_AUTH is on but FIREBASE_PROJECT_ID is not set')
+    app.extensions['firebase_auth'] = TokenVerifier(
+        app.config['FIREBASE_PROJECT_ID'],
+        keys or key_source(app.config['FIREBASE_KEYS']),
+        cache_size=app.config['FIREBASE_TOKEN_CACHE_SIZE'],
+        leeway=app.config['FIREBASE_CLOCK_SKEW']
+    )
+    app.before_request_funcs.setdefault(blueprint, []).append(authenticate)
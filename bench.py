@@ -0,0 +1,485 @@
+import argparse
+import contextlib
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import inspect, select
+from app import create_app
+from config import Config
+from models import db, User, Farm, Variety, Inventory
+from seed_db import seed
+
+# Recorded for a response that failed after its status line, so it counts as an error
+BROKEN_STREAM = 599
+
+# Scratch farms and varieties for the delete and restore routes, told apart by these
+SCRATCH_EMAIL = 'scratch-%s@bench.example.com'
+SCRATCH_NAME = 'Bench scratch %s'
+SCRATCH_LISTINGS = 20
+SCRATCH_ROUTES = {'delete_farm', 'restore_farm', 'delete_variety', 'restore_variety'}
+# An event ID no stream has reached, so the stream sends a reset and ends
+FUTURE_EVENT_ID = 2 ** 62
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+class Scenarios:
+    """Builds one request per route of the main blueprint from IDs in the database"""
+
+    def __init__(self, farm_ids, farm_locations, variety_ids, variety_names, inventory_keys, firebase_ids, free_pairs, seed_value):
+        self.farm_ids = farm_ids
+        self.farm_locations = farm_locations
+        self.variety_ids = variety_ids
+        self.variety_names = variety_names
+        self.inventory_keys = inventory_keys
+        self.inventory_ids = [inventory_id for inventory_id, _, _ in inventory_keys]
+        self.firebase_ids = firebase_ids
+        self.free_pairs = free_pairs
+        self.rng = random.Random(seed_value)
+        self.serial = itertools.count()
+        self.lock = threading.Lock()
+        # delete_* archives scratch rows and restore_* puts them back, so both can repeat
+        self.scratch_farms, self.archived_farms = deque(), deque()
+        self.scratch_varieties, self.archived_varieties = deque(), deque()
+
+    def next_request(self, route):
+        """Return (method, path, body) for a named route; NDJSON bodies are strings"""
+        with self.lock:
+            return getattr(self, route)()
+
+    def _unique(self):
+        return '%d-%d' % (time.time_ns(), next(self.serial))
+
+    def _move(self, source, target):
+        # ID 0 never exists, so a run out of scratch rows measures the 404 path
+        if not source:
+            return 0
+        entry_id = source.popleft()
+        target.append(entry_id)
+        return entry_id
+
+    def list_users(self):
+        return 'GET', '/users?limit=50', None
+
+    def get_user(self):
+        return 'GET', '/users/%s' % self.rng.choice(self.firebase_ids), None
+
+    def batch_get_users(self):
+        return 'POST', '/users/batch-get', {'firebase_ids': self.rng.sample(self.firebase_ids, min(30, len(self.firebase_ids)))}
+
+    def upsert_user(self):
+        # The login path: mostly returning users whose details have not changed
+        firebase_id = self.rng.choice(self.firebase_ids)
+        return 'PUT', '/users/%s' % firebase_id, {'email': '%s@bench.example.com' % firebase_id, 'name': 'Bench'}
+
+    def create_user(self):
+        suffix = self._unique()
+        return 'POST', '/users', {'firebase_id': 'bench-' + suffix, 'email': 'bench-%s@example.com' % suffix, 'name': 'Bench'}
+
+    def list_farms(self):
+        return 'GET', '/farms?limit=20', None
+
+    def get_farm(self):
+        return 'GET', '/farms/%d' % self.rng.choice(self.farm_ids), None
+
+    def nearby_farms(self):
+        latitude, longitude, radius, variety_id = self.nearby_query()
+        query = {'lat': latitude, 'lon': longitude, 'radius': radius}
+        if variety_id is not None:
+            query['variety_id'] = variety_id
+        return 'GET', '/farms/nearby?%s' % urlencode(query), None
+
+    def nearby_query(self):
+        """(latitude, longitude, radius_km, variety_id) around a random farm, half filtered by variety"""
+        latitude, longitude = self.rng.choice(self.farm_locations)
+        variety_id = self.rng.choice(self.variety_ids) if self.rng.random() < 0.5 else None
+        return (round(latitude + self.rng.uniform(-0.2, 0.2), 5), round(longitude + self.rng.uniform(-0.2, 0.2), 5),
+                self.rng.choice([5, 10, 25, 50]), variety_id)
+
+    def get_farm_inventory(self):
+        return 'GET', '/farms/%d/inventory' % self.rng.choice(self.farm_ids), None
+
+    def delete_farm(self):
+        return 'DELETE', '/farms/%d?archive=true' % self._move(self.scratch_farms, self.archived_farms), None
+
+    def restore_farm(self):
+        return 'POST', '/farms/%d/restore' % self._move(self.archived_farms, self.scratch_farms), None
+
+    def set_farm_varieties(self):
+        # A fresh random set each time, so most links are replaced
+        variety_ids = self.rng.sample(self.variety_ids, min(20, len(self.variety_ids)))
+        return 'PUT', '/farms/%d/varieties' % self.rng.choice(self.farm_ids), {'variety_ids': variety_ids}
+
+    def create_farm(self):
+        return 'POST', '/farms', {'email': 'bench-%s@example.com' % self._unique(), 'phone_number': '555-0100'}
+
+    def list_varieties(self):
+        return 'GET', '/varieties?limit=50', None
+
+    def get_variety(self):
+        return 'GET', '/varieties/%d' % self.rng.choice(self.variety_ids), None
+
+    def create_variety(self):
+        return 'POST', '/varieties', {'name': 'Bench %s' % self._unique()}
+
+    def delete_variety(self):
+        return 'DELETE', '/varieties/%d?archive=true' % self._move(self.scratch_varieties, self.archived_varieties), None
+
+    def restore_variety(self):
+        return 'POST', '/varieties/%d/restore' % self._move(self.archived_varieties, self.scratch_varieties), None
+
+    def suggest_varieties(self):
+        # What a buyer has typed so far: part of one word, sometimes with two letters swapped
+        word = self.rng.choice(self.rng.choice(self.variety_names).split())
+        typed = word[:self.rng.randint(min(2, len(word)), len(word))]
+        if len(typed) > 3 and self.rng.random() < 0.3:
+            i = self.rng.randrange(len(typed) - 1)
+            typed = typed[:i] + typed[i + 1] + typed[i] + typed[i + 2:]
+        return 'GET', '/varieties/suggest?%s' % urlencode({'q': typed, 'limit': 10}), None
+
+    def list_variety_stats(self):
+        return 'GET', '/varieties/stats?limit=50', None
+
+    def get_variety_stats(self):
+        return 'GET', '/varieties/%d/stats' % self.rng.choice(self.variety_ids), None
+
+    def batch_get_farms(self):
+        return 'GET', '/farms?ids=%s' % ','.join(map(str, self.rng.sample(self.farm_ids, min(30, len(self.farm_ids))))), None
+
+    def batch_get_varieties(self):
+        return 'GET', '/varieties?ids=%s' % ','.join(map(str, self.rng.sample(self.variety_ids, min(30, len(self.variety_ids))))), None
+
+    def list_inventory(self):
+        return 'GET', '/inventory?limit=50', None
+
+    def get_inventory(self):
+        return 'GET', '/inventory/%d' % self.rng.choice(self.inventory_ids), None
+
+    def search_inventory(self):
+        return 'GET', '/inventory/search?variety_id=%d&min_count=1&limit=20' % self.rng.choice(self.variety_ids), None
+
+    def get_inventory_history(self):
+        return 'GET', '/inventory/%d/history?bucket=day' % self.rng.choice(self.inventory_ids), None
+
+    def reserve_inventory(self):
+        return 'POST', '/inventory/reserve', {'items': [{'inventory_id': self.rng.choice(self.inventory_ids), 'quantity': 1}]}
+
+    def bulk_upsert_inventory(self):
+        # Price sheets mostly restate existing listings, so upsert known pairs
+        rows = [
+            {'farm_id': farm_id, 'variety_id': variety_id,
+             'price': round(self.rng.uniform(1, 20), 2), 'count': self.rng.randint(0, 100)}
+            for _, farm_id, variety_id in self.rng.sample(self.inventory_keys, min(20, len(self.inventory_keys)))
+        ]
+        return 'POST', '/inventory/bulk', '\n'.join(json.dumps(row) for row in rows)
+
+    def create_inventory(self):
+        farm_id, variety_id = next(self.free_pairs)
+        return 'POST', '/inventory', {'farm_id': farm_id, 'variety_id': variety_id, 'price': 1.0}
+
+    def stream_inventory_changes(self):
+        # A live stream never ends; resuming past the newest event sends a reset and
+        # closes, timing the subscribe and replay path with a bounded read
+        return 'GET', '/inventory/stream?last_event_id=%d' % FUTURE_EVENT_ID, None
+
+
+class InProcessClient:
+    """Sends requests straight to the WSGI app, one test client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, method, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        if isinstance(body, str):
+            response = client.open(path, method=method, data=body, content_type='application/x-ndjson')
+        else:
+            response = client.open(path, method=method, json=body)
+        # Streamed bodies are generated as they are read, so read all of it
+        try:
+            response.get_data()
+        except Exception:
+            return BROKEN_STREAM
+        finally:
+            response.close()
+        return response.status_code
+
+
+class HTTPClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, path, body):
+        headers = {}
+        data = None
+        if isinstance(body, str):
+            data, headers['Content-Type'] = body.encode(), 'application/x-ndjson'
+        elif body is not None:
+            data, headers['Content-Type'] = json.dumps(body).encode(), 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                try:
+                    response.read()
+                except (http.client.HTTPException, OSError):
+                    return BROKEN_STREAM
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# Command lines that serve the app on a port: the threaded WSGI deployment
+# and the ASGI one on the async engine
+SERVERS = {
+    'sync': [sys.executable, '-c',
+             'import logging, sys; from werkzeug.serving import run_simple; from app import create_app; '
+             'logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+             'run_simple("127.0.0.1", int(sys.argv[1]), create_app(), threaded=True)', '{port}'],
+    'async': [sys.executable, '-m', 'uvicorn', 'asgi:create_asgi_app', '--factory',
+              '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning']
+}
+
+
+@contextlib.contextmanager
+def serve(kind, database_url):
+    """Start a server process on a free port and yield (base_url, process)"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    command = [part.format(port=port) for part in SERVERS[kind]]
+    env = dict(os.environ, DATABASE_URL=database_url, ASYNC_DATABASE_URL='')
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                sys.exit('%s server exited with status %d' % (kind, process.returncode))
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    sys.exit('%s server did not start' % kind)
+                time.sleep(0.1)
+        yield 'http://127.0.0.1:%d' % port, process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def memory_mb(pid):
+    """Current and peak resident memory of a process in MB, from /proc (Linux only)"""
+    values = {}
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    values[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def run_route(client, scenarios, route, requests, concurrency):
+    """Fire requests at one route and return throughput and latency percentiles"""
+    def timed(_):
+        method, path, body = scenarios.next_request(route)
+        started = time.perf_counter()
+        status = client.send(method, path, body)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        'route': route,
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status >= 500),
+        'rps': requests / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99)
+    }
+
+
+def load_scenarios(seed_value):
+    def sample(column, *where):
+        return list(db.session.scalars(select(column).where(*where).order_by(column).limit(10000)))
+
+    # Scratch rows come and go while the delete and restore routes run
+    real_farm = Farm.email.notlike(SCRATCH_EMAIL % '%')
+    real_variety = Variety.name.notlike(SCRATCH_NAME % '%')
+    farm_ids, variety_ids = sample(Farm.id, real_farm), sample(Variety.id, real_variety)
+    farm_locations = list(db.session.execute(
+        select(Farm.latitude, Farm.longitude).where(Farm.geohash.isnot(None), real_farm).order_by(Farm.id).limit(10000)
+    ).tuples())
+    taken = set(db.session.execute(
+        select(Inventory.farm_id, Inventory.variety_id).where(Inventory.farm_id.in_(farm_ids[:100]))
+    ).tuples())
+    # (farm, variety) pairs without inventory yet, for create_inventory to claim
+    free_pairs = (
+        (farm_id, variety_id)
+        for farm_id in farm_ids[:100] for variety_id in variety_ids
+        if (farm_id, variety_id) not in taken
+    )
+    inventory_keys = list(db.session.execute(
+        select(Inventory.id, Inventory.farm_id, Inventory.variety_id).order_by(Inventory.id).limit(10000)
+    ).tuples())
+    return Scenarios(farm_ids, farm_locations, variety_ids, sample(Variety.name, real_variety), inventory_keys,
+                     sample(User.firebase_id), free_pairs, seed_value)
+
+
+def add_scratch_rows(scenarios, count):
+    """Give the delete and restore routes count farms and varieties with listings to archive
+
+    Live scratch rows left by earlier runs are reused; each new one gets
+    SCRATCH_LISTINGS listings so archiving it moves real inventory.
+    """
+    farm_ids = list(db.session.scalars(
+        select(Farm.id).where(Farm.email.like(SCRATCH_EMAIL % '%')).order_by(Farm.id).limit(count)))
+    variety_ids = list(db.session.scalars(
+        select(Variety.id).where(Variety.name.like(SCRATCH_NAME % '%')).order_by(Variety.id).limit(count)))
+    listings = []
+    for _ in range(count - len(farm_ids)):
+        farm_id = Farm.create_farm(SCRATCH_EMAIL % scenarios._unique(), '555-0100').id
+        farm_ids.append(farm_id)
+        listings.extend((farm_id, variety_id) for variety_id in
+                        scenarios.rng.sample(scenarios.variety_ids, min(SCRATCH_LISTINGS, len(scenarios.variety_ids))))
+    for _ in range(count - len(variety_ids)):
+        variety_id = Variety.create_variety(SCRATCH_NAME % scenarios._unique()).id
+        variety_ids.append(variety_id)
+        listings.extend((farm_id, variety_id) for farm_id in
+                        scenarios.rng.sample(scenarios.farm_ids, min(SCRATCH_LISTINGS, len(scenarios.farm_ids))))
+    if listings:
+        Inventory.bulk_upsert([
+            (line, {'farm_id': farm_id, 'variety_id': variety_id, 'price': 1.0, 'count': 10})
+            for line, (farm_id, variety_id) in enumerate(listings, 1)
+        ])
+    scenarios.scratch_farms.extend(farm_ids)
+    scenarios.scratch_varieties.extend(variety_ids)
+
+
+def bench_database(database_url, args):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        if not inspect(db.engine).has_table(Inventory.__tablename__):
+            db.create_all()
+        if args.seed_farms:
+            seed(args.seed_farms * 10, args.seed_farms, args.seed_varieties, 20, args.seed)
+        scenarios = load_scenarios(args.seed)
+    if not (scenarios.farm_ids and scenarios.variety_ids and scenarios.inventory_keys and scenarios.firebase_ids):
+        sys.exit('%s has no data to benchmark; pass --seed-farms' % database_url)
+
+    endpoints = {rule.endpoint.split('.', 1)[1] for rule in app.url_map.iter_rules() if rule.endpoint.startswith('main.')}
+    # Scenarios cover endpoints by name, plus variants such as batch gets
+    scenario_names = {name for name in vars(Scenarios) if not name.startswith('_') and name not in ('next_request', 'nearby_query')}
+    routes = [route for route in args.routes or sorted(scenario_names) if route in scenario_names]
+    skipped = sorted(endpoints - set(routes))
+    if SCRATCH_ROUTES.intersection(routes):
+        with app.app_context():
+            add_scratch_rows(scenarios, args.requests)
+
+    if args.servers:
+        for kind in args.servers:
+            with serve(kind, database_url) as (base_url, process):
+                run_routes('%s (%s server)' % (database_url, kind), HTTPClient(base_url), scenarios, routes, args, process.pid)
+    else:
+        client = HTTPClient(args.url) if args.url else InProcessClient(app)
+        run_routes('%s (%s)' % (database_url, args.url or 'in-process'), client, scenarios, routes, args)
+    if 'nearby_farms' in routes and scenarios.farm_locations:
+        with app.app_context():
+            compare_nearby(scenarios, args.requests)
+    if skipped:
+        print("not benchmarked: %s" % ', '.join(skipped))
+
+
+def run_routes(title, client, scenarios, routes, args, server_pid=None):
+    for concurrency in args.concurrency:
+        print("\n%s, concurrency %d" % (title, concurrency))
+        print("%-24s %8s %7s %9s %8s %8s %8s %8s" % ('route', 'requests', 'errors', 'req/s', 'mean', 'p50', 'p95', 'p99'))
+        for route in routes:
+            result = run_route(client, scenarios, route, args.requests, concurrency)
+            print("%-24s %8d %7d %9.1f %8.2f %8.2f %8.2f %8.2f" % (
+                result['route'], result['requests'], result['errors'], result['rps'],
+                result['mean_ms'], result['p50_ms'], result['p95_ms'], result['p99_ms']))
+        if server_pid is not None:
+            rss, peak = memory_mb(server_pid)
+            if rss is not None:
+                print("server memory: %.1f MB resident, %.1f MB peak" % (rss, peak))
+
+
+def compare_nearby(scenarios, requests):
+    """Time Farm.nearby through the geohash index against a scan of every farm"""
+    queries = [scenarios.nearby_query() for _ in range(requests)]
+    timings, results = {}, {}
+    for use_index in (True, False):
+        samples, found = [], []
+        for latitude, longitude, radius, variety_id in queries:
+            started = time.perf_counter()
+            nearest = Farm.nearby(latitude, longitude, radius, variety_id, use_index=use_index)
+            samples.append((time.perf_counter() - started) * 1000)
+            found.append([farm.id for farm, _ in nearest])
+            db.session.rollback()
+        timings[use_index], results[use_index] = sorted(samples), found
+    mismatches = sum(1 for indexed, scanned in zip(results[True], results[False]) if indexed != scanned)
+    print("\nFarm.nearby over %d queries: %d result mismatches" % (len(queries), mismatches))
+    for use_index, label in ((True, 'geohash index'), (False, 'full scan')):
+        samples = timings[use_index]
+        print("%-24s mean %8.2f  p50 %8.2f  p99 %8.2f ms" % (
+            label, statistics.mean(samples), percentile(samples, 0.5), percentile(samples, 0.99)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route of the API')
+    parser.add_argument('--database-url', action='append', dest='database_urls',
+                        help='Database to benchmark; repeat to compare, e.g. SQLite and a local Postgres')
+    parser.add_argument('--url', help='Drive a running server instead of the in-process app')
+    parser.add_argument('--server', action='append', dest='servers', choices=sorted(SERVERS),
+                        help='Start this deployment and drive it over HTTP; repeat to compare sync and async')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8],
+                        help='Concurrent clients; several values sweep them')
+    parser.add_argument('--routes', nargs='*', help='Only these endpoint names')
+    parser.add_argument('--seed-farms', type=int, default=0, help='Seed this many farms before running')
+    parser.add_argument('--seed-varieties', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    for database_url in args.database_urls or [Config.SQLALCHEMY_DATABASE_URI]:
+        bench_database(database_url, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
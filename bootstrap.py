@@ -0,0 +1,252 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from config import Config
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(ROOT, 'migrations')
+# Where Flask-SQLAlchemy resolves relative SQLite paths
+INSTANCE_DIR = os.path.join(ROOT, 'instance')
+
+
+class BootstrapError(Exception):
+    """Raised when a database cannot safely be brought to the current schema"""
+
+
+def resolve(url):
+    """Parse a database URL, making relative SQLite paths absolute the way the app does"""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        if not url.database or url.database == ':memory:' or url.query.get('mode') == 'memory':
+            raise BootstrapError('An in-memory SQLite database does not outlive its connection')
+        if not os.path.isabs(url.database):
+            url = url.set(database=os.path.join(INSTANCE_DIR, url.database))
+    return url
+
+
+def head_revisions():
+    """The revisions the migration scripts end at"""
+    return set(ScriptDirectory(MIGRATIONS_DIR).get_heads())
+
+
+def inspect_schema(url):
+    """Get (stamped revisions, application tables) of the database at url"""
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            stamped = set(MigrationContext.configure(connection).get_current_heads())
+            tables = set(inspect(connection).get_table_names()) - {'alembic_version'}
+    finally:
+        engine.dispose()
+    return stamped, tables
+
+
+def ensure_database(url):
+    """Create the database at url if the server does not have it yet"""
+    if url.get_backend_name() == 'sqlite':
+        os.makedirs(os.path.dirname(url.database), exist_ok=True)
+        return
+    engine = _server_engine(url)
+    try:
+        with engine.connect() as connection:
+            if not _database_exists(connection, url.database):
+                connection.execute(text('CREATE DATABASE ' + _quote(connection, url.database)))
+    finally:
+        engine.dispose()
+
+
+def bootstrap(url, seed_farms=0, seed_varieties=200, seed_value=42):
+    """Bring the database at url to the latest migration without dropping anything
+
+    Returns what was done: 'current' if it already was, 'upgraded' when
+    only the missing migrations ran, 'created' for an empty database, or
+    'stamped' for a schema made by create_all that matches the models. An
+    unversioned schema that differs from them raises BootstrapError. Seed
+    data only goes into a schema this call created, so reruns never add
+    it twice.
+    """
+    url = resolve(url)
+    ensure_database(url)
+    stamped, tables = inspect_schema(url)
+    if stamped == head_revisions():
+        return 'current'
+
+    # The app is only needed, and only imported, when there is work to do
+    from app import create_app
+    from models import db
+    from seed_db import seed
+
+    class BootstrapConfig(Config):
+        SQLALCHEMY_DATABASE_URI = url.render_as_string(hide_password=False)
+
+    app = create_app(BootstrapConfig)
+    with app.app_context():
+        config = app.extensions['migrate'].migrate.get_config(MIGRATIONS_DIR)
+        if stamped:
+            command.upgrade(config, 'heads')
+            action = 'upgraded'
+        elif tables:
+            with db.engine.connect() as connection:
+                differences = compare_metadata(MigrationContext.configure(connection), db.metadata)
+            if differences:
+                raise BootstrapError('%s has tables but no migration history and differs from the models '
+                                     '(%d changes, first %r); stamp its revision with flask db stamp first'
+                                     % (_display(url), len(differences), differences[0]))
+            command.stamp(config, 'heads')
+            action = 'stamped'
+        else:
+            command.upgrade(config, 'heads')
+            action = 'created'
+            if seed_farms:
+                seed(seed_farms * 10, seed_farms, seed_varieties, 20, seed_value)
+        db.session.remove()
+        # A PostgreSQL template cannot be copied while connections to it stay open
+        db.engine.dispose()
+    return action
+
+
+def clone(template_url, url):
+    """Replace the database at url with a copy of the one at template_url
+
+    SQLite copies the file; PostgreSQL creates the database from the
+    template, which must have no open connections.
+    """
+    template_url, url = resolve(template_url), resolve(url)
+    backend = url.get_backend_name()
+    if template_url.get_backend_name() != backend:
+        raise BootstrapError('The template and the database must use the same backend')
+    if backend == 'sqlite':
+        os.makedirs(os.path.dirname(url.database), exist_ok=True)
+        # A leftover journal would be replayed into the copy
+        for suffix in ('-journal', '-wal', '-shm'):
+            if os.path.exists(url.database + suffix):
+                os.remove(url.database + suffix)
+        _copy_file(template_url.database, url.database)
+    elif backend == 'postgresql':
+        engine = _server_engine(url)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('DROP DATABASE IF EXISTS ' + _quote(connection, url.database)))
+                connection.execute(text('CREATE DATABASE %s TEMPLATE %s' % (
+                    _quote(connection, url.database), _quote(connection, template_url.database))))
+        finally:
+            engine.dispose()
+    else:
+        raise BootstrapError('Template copies need SQLite or PostgreSQL, not %s' % backend)
+
+
+def bootstrap_from_template(template_url, url, **seed_options):
+    """Give the database at url a fresh copy of the template, bootstrapping the template first
+
+    Parallel callers can share one template. A SQLite template is rebuilt in
+    a scratch file and moved into place, so a copy never sees it half
+    migrated; a PostgreSQL one is bootstrapped and copied under an advisory
+    lock.
+    """
+    template_url = resolve(template_url)
+    backend = template_url.get_backend_name()
+    if backend == 'sqlite':
+        path = template_url.database
+        if not os.path.exists(path) or inspect_schema(template_url)[0] != head_revisions():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, scratch = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.db')
+            os.close(handle)
+            try:
+                if os.path.exists(path):
+                    shutil.copyfile(path, scratch)
+                bootstrap(template_url.set(database=scratch), **seed_options)
+                os.replace(scratch, path)
+            finally:
+                if os.path.exists(scratch):
+                    os.remove(scratch)
+        clone(template_url, url)
+    elif backend == 'postgresql':
+        engine = _server_engine(template_url)
+        try:
+            with engine.connect() as lock:
+                lock.execute(text('SELECT pg_advisory_lock(hashtext(:name))'), {'name': template_url.database})
+                try:
+                    bootstrap(template_url, **seed_options)
+                    clone(template_url, url)
+                finally:
+                    lock.execute(text('SELECT pg_advisory_unlock(hashtext(:name))'), {'name': template_url.database})
+        finally:
+            engine.dispose()
+    else:
+        raise BootstrapError('Template copies need SQLite or PostgreSQL, not %s' % backend)
+    return 'cloned'
+
+
+def _server_engine(url):
+    # CREATE and DROP DATABASE run outside transactions, from a database that always exists
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        server_url = url.set(database='postgres')
+    elif backend == 'mysql':
+        server_url = url.set(database=None)
+    else:
+        raise BootstrapError('Cannot create %s databases' % backend)
+    return create_engine(server_url, isolation_level='AUTOCOMMIT', poolclass=NullPool)
+
+
+def _database_exists(connection, name):
+    if connection.dialect.name == 'postgresql':
+        query = text('SELECT 1 FROM pg_database WHERE datname = :name')
+    else:
+        query = text('SELECT 1 FROM information_schema.schemata WHERE schema_name = :name')
+    return connection.execute(query, {'name': name}).first() is not None
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _copy_file(source, target):
+    # Copy beside the target and rename, so nothing opens a partial file
+    handle, scratch = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.db')
+    os.close(handle)
+    try:
+        shutil.copyfile(source, scratch)
+        os.replace(scratch, target)
+    except BaseException:
+        os.remove(scratch)
+        raise
+
+
+def _display(url):
+    return url.render_as_string(hide_password=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or migrate the database to the latest schema, keeping its data')
+    parser.add_argument('--database-url', default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument('--template', help='Replace the database with a copy of this one, bootstrapped first')
+    parser.add_argument('--seed-farms', type=int, default=0, help='Seed this many farms into a newly created schema')
+    parser.add_argument('--seed-varieties', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    seed_options = {'seed_farms': args.seed_farms, 'seed_varieties': args.seed_varieties, 'seed_value': args.seed}
+    started = time.perf_counter()
+    try:
+        if args.template:
+            action = bootstrap_from_template(args.template, args.database_url, **seed_options)
+        else:
+            action = bootstrap(args.database_url, **seed_options)
+    except BootstrapError as exc:
+        sys.exit(str(exc))
+    print("%s: %s in %.3fs" % (_display(resolve(args.database_url)), action, time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
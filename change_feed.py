@@ -0,0 +1,345 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from flask import Response, current_app, has_app_context, jsonify
+from sqlalchemy import delete, event, func, insert, or_, select
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+from werkzeug.utils import import_string
+from models import db
+from models.change_event import ChangeEvent
+
+
+class SubscriberOverflow(Exception):
+    """Raised when a subscriber fell further behind than its buffer allows"""
+
+
+class Subscription:
+    """A bounded buffer of events for one stream
+
+    Publishers never wait for a slow reader: once the buffer is full the
+    subscription is cut off, and the client resumes from its last event ID.
+    """
+
+    def __init__(self, farm_id, maxsize):
+        self.farm_id = farm_id
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._events = deque()
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        with self._ready:
+            if self.overflowed:
+                return
+            if len(self._events) >= self.maxsize:
+                self.overflowed = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Take every buffered event, waiting up to timeout seconds for one; [] on timeout"""
+        if in_greenlet():
+            # Under the ASGI server, waiting on a thread condition would stall the event loop
+            deadline = time.monotonic() + timeout
+            while not (self._events or self.overflowed) and time.monotonic() < deadline:
+                await_only(asyncio.sleep(0.05))
+        else:
+            with self._ready:
+                self._ready.wait_for(lambda: self._events or self.overflowed, timeout)
+        with self._ready:
+            if self.overflowed:
+                raise SubscriberOverflow()
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class ChangeHub:
+    """Fans events out to this process's subscriptions"""
+
+    def __init__(self, buffer_size=1000):
+        self.buffer_size = buffer_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, farm_id=None):
+        subscription = Subscription(farm_id, self.buffer_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            if subscription.overflowed:
+                self.overflows += 1
+
+    def deliver(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self.delivered += len(events)
+        for subscription in subscriptions:
+            for change in events:
+                if _matches(change, subscription.farm_id):
+                    subscription.push(change)
+
+    def to_dict(self):
+        with self._lock:
+            return {'subscribers': len(self._subscriptions), 'delivered': self.delivered, 'overflows': self.overflows}
+
+
+class InProcessBus:
+    """Delivers committed changes to this process only, keeping recent ones for resumes
+
+    Enough for tests and single-worker deployments; event IDs restart with
+    the process.
+    """
+
+    def __init__(self, history=10000):
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._deliver = None
+
+    def start(self, app, deliver):
+        self._deliver = deliver
+
+    def stage(self, session, changes):
+        pass
+
+    def committed(self, changes):
+        with self._lock:
+            events = [dict(change, id=next(self._ids)) for change in changes]
+            self._history.extend(events)
+        if self._deliver is not None:
+            self._deliver(events)
+
+    def replay(self, after_id, farm_id, limit):
+        """Get events after after_id, or None when they are no longer all available"""
+        with self._lock:
+            history = list(self._history)
+        last_id = history[-1]['id'] if history else 0
+        oldest_id = history[0]['id'] if history else 1
+        if after_id > last_id or after_id < oldest_id - 1:
+            return None
+        events = [
+            change for change in history
+            if change['id'] > after_id and _matches(change, farm_id)
+        ]
+        return events if len(events) <= limit else None
+
+
+class DatabaseBus:
+    """Carries changes between workers through the change_events outbox table
+
+    Events are inserted in the same transaction as the change, so they exist
+    exactly when it commits. Every worker polls the table and delivers new
+    rows locally. An ID gap is waited on for gap_grace seconds, since a lower
+    ID may belong to a transaction that has not committed yet.
+    """
+
+    def __init__(self, poll_interval=0.5, retention=3600, gap_grace=5, batch_size=1000):
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.gap_grace = gap_grace
+        self.batch_size = batch_size
+
+    def start(self, app, deliver):
+        if db.engine.dialect.is_async:
+            raise RuntimeError('CHANGE_FEED=database needs a sync engine; use the WSGI deployment')
+        last_id = db.session.execute(select(func.max(ChangeEvent.id))).scalar() or 0
+        thread = threading.Thread(target=self._poll, args=(app, deliver, last_id), name='change-feed-poller', daemon=True)
+        thread.start()
+
+    def stage(self, session, changes):
+        now = datetime.utcnow()
+        session.execute(insert(ChangeEvent.__table__), [
+            {'kind': change['kind'], 'farm_id': change['farm_id'],
+             'payload': json.dumps(change['data'], separators=(',', ':')), 'created_at': now}
+            for change in changes
+        ])
+
+    def committed(self, changes):
+        pass
+
+    def replay(self, after_id, farm_id, limit):
+        """Get events after after_id, or None when they are no longer all available"""
+        oldest_id, last_id = db.session.execute(select(func.min(ChangeEvent.id), func.max(ChangeEvent.id))).one()
+        if last_id is None or after_id > last_id or after_id < oldest_id - 1:
+            return None
+        query = select(ChangeEvent).where(ChangeEvent.id > after_id).order_by(ChangeEvent.id).limit(limit + 1)
+        if farm_id is not None:
+            query = query.where(or_(ChangeEvent.farm_id == farm_id, ChangeEvent.farm_id.is_(None)))
+        rows = db.session.scalars(query).all()
+        return [row.to_event() for row in rows] if len(rows) <= limit else None
+
+    def _poll(self, app, deliver, last_id):
+        pruned_at = 0
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with app.app_context():
+                    last_id = self._deliver_new(last_id, deliver)
+                    if time.monotonic() - pruned_at > 60:
+                        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+                        db.session.execute(delete(ChangeEvent.__table__).where(ChangeEvent.created_at < cutoff))
+                        db.session.commit()
+                        pruned_at = time.monotonic()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception('Change feed poll failed')
+
+    def _deliver_new(self, last_id, deliver):
+        rows = db.session.scalars(
+            select(ChangeEvent).where(ChangeEvent.id > last_id).order_by(ChangeEvent.id).limit(self.batch_size)
+        ).all()
+        settled = datetime.utcnow() - timedelta(seconds=self.gap_grace)
+        events = []
+        for row in rows:
+            if row.id != last_id + 1 and row.created_at > settled:
+                break
+            events.append(row.to_event())
+            last_id = row.id
+        if events:
+            deliver(events)
+        return last_id
+
+
+class ChangeFeed:
+    """Publishes committed model changes and serves them as Server-Sent Events"""
+
+    def __init__(self, app, bus):
+        self.hub = ChangeHub(app.config['CHANGE_FEED_BUFFER'])
+        self.heartbeat = app.config['CHANGE_FEED_HEARTBEAT']
+        self.bus = bus
+        self._started = False
+        self._lock = threading.Lock()
+
+    def stream(self, farm_id=None, last_event_id=None):
+        """Build a text/event-stream response, first replaying what followed last_event_id"""
+        # Buses start with the first stream, so CLI and migration runs never poll
+        with self._lock:
+            if not self._started:
+                self.bus.start(current_app._get_current_object(), self.hub.deliver)
+                self._started = True
+        subscription = self.hub.subscribe(farm_id)
+        replay = []
+        if last_event_id is not None:
+            replay = self.bus.replay(last_event_id, farm_id, self.hub.buffer_size)
+            # Do not hold a pooled connection for the life of the stream
+            db.session.close()
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+                if replay is None:
+                    yield _reset()
+                    return
+                sent = last_event_id
+                for change in replay:
+                    yield _format(change)
+                    sent = change['id']
+                while True:
+                    try:
+                        events = subscription.get(self.heartbeat)
+                    except SubscriberOverflow:
+                        yield _reset()
+                        return
+                    if not events:
+                        yield ': keepalive\n\n'
+                    for change in events:
+                        if sent is None or change['id'] > sent:
+                            yield _format(change)
+                            sent = change['id']
+            finally:
+                self.hub.unsubscribe(subscription)
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+
+def _matches(change, farm_id):
+    # Events without a farm, such as a deleted variety, concern every farm
+    return farm_id is None or change['farm_id'] is None or change['farm_id'] == farm_id
+
+
+def _format(change):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (change['id'], change['kind'], json.dumps(change['data'], separators=(',', ':')))
+
+
+def _reset():
+    # The client cannot catch up from its position and should refetch state
+    return 'event: reset\ndata: {}\n\n'
+
+
+def _feed():
+    return current_app.extensions.get('change_feed') if has_app_context() else None
+
+
+def _before_commit(session):
+    changes = session.info.get('pending_changes')
+    feed = _feed()
+    if changes and feed is not None:
+        feed.bus.stage(session, changes)
+
+
+def _after_commit(session):
+    changes = session.info.pop('pending_changes', None)
+    session.info.pop('savepoint_marks', None)
+    feed = _feed()
+    if changes and feed is not None:
+        feed.bus.committed(changes)
+
+
+def _after_transaction_create(session, transaction):
+    # Remember where each savepoint starts in the pending changes
+    if transaction.nested:
+        marks = session.info.setdefault('savepoint_marks', {})
+        marks[transaction] = len(session.info.get('pending_changes', ()))
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # A savepoint rollback drops only the changes staged since it began
+    if previous_transaction.nested:
+        mark = session.info.get('savepoint_marks', {}).pop(previous_transaction, None)
+        if mark is not None:
+            del session.info.get('pending_changes', [])[mark:]
+    else:
+        session.info.pop('pending_changes', None)
+        session.info.pop('savepoint_marks', None)
+
+
+def init_app(app):
+    """Publish model changes through the CHANGE_FEED bus; counters at /metrics/change-feed"""
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'before_commit', _before_commit)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_transaction_create', _after_transaction_create)
+        event.listen(db.session, 'after_soft_rollback', _after_soft_rollback)
+
+    name = app.config['CHANGE_FEED']
+    if name == 'off':
+        return
+    if name == 'memory':
+        bus = InProcessBus(app.config['CHANGE_FEED_HISTORY'])
+    elif name == 'database':
+        bus = DatabaseBus(app.config['CHANGE_FEED_POLL_INTERVAL'], app.config['CHANGE_FEED_RETENTION'])
+    else:
+        bus = import_string(name)()
+    app.extensions['change_feed'] = ChangeFeed(app, bus)
+    app.add_url_rule('/metrics/change-feed', 'change_feed_metrics', change_feed_metrics_view)
+
+
+def change_feed_metrics_view():
+    return jsonify(current_app.extensions['change_feed'].hub.to_dict())
@@ -0,0 +1,21 @@
+import click
+from models import VarietyStats
+
+
+@click.command('rebuild-variety-stats')
+@click.option('--verify-only', is_flag=True, help='Only compare the stats with the inventory table.')
+def rebuild_variety_stats(verify_only):
+    """Recompute variety_stats from inventory and verify the result."""
+    if not verify_only:
+        VarietyStats.rebuild()
+        click.echo('Rebuilt variety stats')
+    mismatches = VarietyStats.verify()
+    for mismatch in mismatches:
+        click.echo('variety %(variety_id)s %(field)s: expected %(expected)s, stored %(actual)s' % mismatch)
+    if mismatches:
+        raise click.ClickException('%d mismatched fields' % len(mismatches))
+    click.echo('Variety stats match the inventory table')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_variety_stats)
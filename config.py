@@ -7,9 +7,105 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///merybery.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Used by the ASGI entry point; defaults to DATABASE_URL with its asyncio driver
+    ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', '')
     
+    # Connection pool. Sizing applies to server databases only, and the
+    # statement timeout (milliseconds, 0 disables it) to Postgres only
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+
+    # Read replicas, comma-separated. GET requests read from a random one and
+    # everything else uses DATABASE_URL. A client that wrote reads from the
+    # primary for the next REPLICA_STICKY_SECONDS, tracked by a cookie it can
+    # also send back as an X-Read-Primary-Until header
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
+    # Per-request SQL profiling: Server-Timing headers, a structured log line
+    # and, in debug mode, /debug/sql. A statement shape repeated at least the
+    # threshold number of times in one request is flagged as a likely N+1
+    SQL_PROFILING = os.getenv('SQL_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+    SQL_PROFILING_NPLUS1_THRESHOLD = int(os.getenv('SQL_PROFILING_NPLUS1_THRESHOLD', '5'))
+    SQL_PROFILING_HISTORY = int(os.getenv('SQL_PROFILING_HISTORY', '500'))
+
+    # JSON encoder: 'auto' uses orjson when installed, otherwise 'default',
+    # 'orjson' or an import path to a flask.json.provider.JSONProvider
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
+
+    # Concurrent identical GETs of one record share a single load and
+    # serialized body; waiters give up after the timeout (seconds) and load
+    # it themselves
+    SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', 'true').lower() in ('1', 'true', 'yes')
+    SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '5'))
+
+    # Inventory and farm change feed served at /inventory/stream. The bus is
+    # 'memory' (this process only), 'database' (an outbox table every worker
+    # polls), 'off' or an import path. A subscriber further behind than the
+    # buffer is told to reset; history is how many events 'memory' keeps for
+    # resumes, retention how many seconds 'database' keeps them
+    CHANGE_FEED = os.getenv('CHANGE_FEED', 'memory')
+    CHANGE_FEED_BUFFER = int(os.getenv('CHANGE_FEED_BUFFER', '1000'))
+    CHANGE_FEED_HISTORY = int(os.getenv('CHANGE_FEED_HISTORY', '10000'))
+    CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '0.5'))
+    CHANGE_FEED_RETENTION = int(os.getenv('CHANGE_FEED_RETENTION', '3600'))
+    CHANGE_FEED_HEARTBEAT = float(os.getenv('CHANGE_FEED_HEARTBEAT', '15'))
+
     # Security configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
+
+    # Firebase ID token checks on the API (needs PyJWT). FIREBASE_KEYS is a
+    # JWKS URL, a local JWKS file or 'import:' plus a key source factory.
+    # Verified tokens are remembered until they expire; clock skew is seconds
+    FIREBASE_AUTH = os.getenv('FIREBASE_AUTH', 'false').lower() in ('1', 'true', 'yes')
+    FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID', '')
+    FIREBASE_KEYS = os.getenv('FIREBASE_KEYS', 'https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com')
+    FIREBASE_TOKEN_CACHE_SIZE = int(os.getenv('FIREBASE_TOKEN_CACHE_SIZE', '10000'))
+    FIREBASE_CLOCK_SKEW = int(os.getenv('FIREBASE_CLOCK_SKEW', '5'))
     
+    # Variety catalog cache: entry lifetime and version check interval are in
+    # seconds, the size bound is a number of varieties
+    VARIETY_CACHE_TTL = int(os.getenv('VARIETY_CACHE_TTL', '300'))
+    VARIETY_CACHE_SIZE = int(os.getenv('VARIETY_CACHE_SIZE', '10000'))
+    VARIETY_CACHE_VERSION_INTERVAL = float(os.getenv('VARIETY_CACHE_VERSION_INTERVAL', '5'))
+
     # CORS configuration
-    CORS_HEADERS = 'Content-Type' 
\ No newline at end of file
+    CORS_HEADERS = 'Content-Type'
+
+
+def engine_options(config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings for the configured database"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    }
+    if uri.startswith('sqlite'):
+        return options
+
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT']
+    )
+    if uri.startswith('postgresql+asyncpg') and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {
+            'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}
+        }
+    elif uri.startswith('postgresql') and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {
+            'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']
+        }
+    return options
+
+
+def replica_binds(config):
+    """Build SQLALCHEMY_BINDS entries for DATABASE_REPLICA_URLS, pooled like the primary"""
+    return {
+        'replica_%d' % index: dict(config['SQLALCHEMY_ENGINE_OPTIONS'], url=url)
+        for index, url in enumerate(config['DATABASE_REPLICA_URLS'])
+    }
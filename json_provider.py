@@ -0,0 +1,45 @@
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.utils import import_string
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, producing the default one's output except that
+    non-ASCII text is written as UTF-8 rather than escaped"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        # jsonify always asks for compact separators or, in debug, an indent of 2
+        if kwargs.get('indent') == 2:
+            option |= orjson.OPT_INDENT_2
+            kwargs.pop('indent')
+        elif kwargs.get('separators') == (',', ':'):
+            kwargs.pop('separators')
+        if kwargs:
+            # Other json.dumps options stay on the stdlib path
+            return super().dumps(obj, **kwargs)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def provider_class(name):
+    """Resolve JSON_PROVIDER: 'auto', 'default', 'orjson' or an import path"""
+    if name == 'auto':
+        return OrjsonProvider if orjson is not None else DefaultJSONProvider
+    if name == 'default':
+        return DefaultJSONProvider
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_PROVIDER is orjson but orjson is not installed')
+        return OrjsonProvider
+    return import_string(name)
@@ -0,0 +1,51 @@
+"""Stop SQLite reusing the IDs of deleted farms, varieties and inventory
+
+Revision ID: 05c4f7ad67b0
+Revises: 067e10593b84
+Create Date: 2026-10-18 21:40:12.318904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '05c4f7ad67b0'
+down_revision = '067e10593b84'
+branch_labels = None
+depends_on = None
+
+# Archived rows keep their IDs, so a new row must never get one again;
+# other backends never hand out a sequence value twice
+ARCHIVES = {'farms': 'archived_farms', 'varieties': 'archived_varieties', 'inventory': 'archived_inventory'}
+
+
+def upgrade():
+    if _recreate(autoincrement=True):
+        # IDs archived above every live one were handed out already too
+        bind = op.get_bind()
+        for table, archive in ARCHIVES.items():
+            archived = bind.execute(sa.text('SELECT max(id) FROM %s' % archive)).scalar()
+            current = bind.execute(sa.text('SELECT seq FROM sqlite_sequence WHERE name = :name'),
+                                   {'name': table}).scalar()
+            if archived is not None and (current is None or archived > current):
+                bind.execute(sa.text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table})
+                bind.execute(sa.text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                             {'name': table, 'seq': archived})
+
+
+def downgrade():
+    _recreate(autoincrement=False)
+
+
+def _recreate(autoincrement):
+    if op.get_bind().dialect.name != 'sqlite':
+        return False
+    for table in ARCHIVES:
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+            pass
+    # Batch mode copies indexes without their WHERE clause
+    op.drop_index('ix_inventory_variety_price_in_stock', table_name='inventory')
+    op.create_index('ix_inventory_variety_price_in_stock', 'inventory', ['variety_id', 'price'], unique=False,
+                    sqlite_where=sa.text('count > 0'))
+    return True
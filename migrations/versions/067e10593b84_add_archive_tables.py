@@ -0,0 +1,71 @@
+"""Add archive tables for deleted farms and varieties
+
+Revision ID: 067e10593b84
+Revises: 9469c0344236
+Create Date: 2026-10-18 20:03:51.226470
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '067e10593b84'
+down_revision = '9469c0344236'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_farms',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('phone_number', sa.String(length=20), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('geohash', sa.String(length=8), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('archived_varieties',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('archived_inventory',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('farm_id', sa.Integer(), nullable=False),
+    sa.Column('variety_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_archived_inventory_farm_id', 'archived_inventory', ['farm_id'], unique=False)
+    op.create_index('ix_archived_inventory_variety_id', 'archived_inventory', ['variety_id'], unique=False)
+    op.create_table('archived_farm_varieties',
+    sa.Column('farm_id', sa.Integer(), nullable=False),
+    sa.Column('variety_id', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('farm_id', 'variety_id')
+    )
+    op.create_index('ix_archived_farm_varieties_variety_id', 'archived_farm_varieties', ['variety_id'], unique=False)
+    op.create_index('ix_farm_variety_variety_id', 'farm_variety', ['variety_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_farm_variety_variety_id', table_name='farm_variety')
+    op.drop_index('ix_archived_farm_varieties_variety_id', table_name='archived_farm_varieties')
+    op.drop_table('archived_farm_varieties')
+    op.drop_index('ix_archived_inventory_variety_id', table_name='archived_inventory')
+    op.drop_index('ix_archived_inventory_farm_id', table_name='archived_inventory')
+    op.drop_table('archived_inventory')
+    op.drop_table('archived_varieties')
+    op.drop_table('archived_farms')
@@ -0,0 +1,49 @@
+"""Add price history and rollups
+
+Revision ID: 09eadf1e0565
+Revises: 882f25a800be
+Create Date: 2026-10-18 16:32:10.418026
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '09eadf1e0565'
+down_revision = '882f25a800be'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('price_history',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('farm_id', sa.Integer(), nullable=False),
+    sa.Column('variety_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('recorded_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_price_history_listing_time', 'price_history', ['farm_id', 'variety_id', 'recorded_at'], unique=False)
+
+    op.create_table('price_rollups',
+    sa.Column('farm_id', sa.Integer(), nullable=False),
+    sa.Column('variety_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.String(length=8), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('min_price', sa.Float(), nullable=False),
+    sa.Column('max_price', sa.Float(), nullable=False),
+    sa.Column('last_price', sa.Float(), nullable=False),
+    sa.Column('last_count', sa.Integer(), nullable=False),
+    sa.Column('last_at', sa.DateTime(), nullable=False),
+    sa.Column('samples', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('farm_id', 'variety_id', 'bucket', 'bucket_start')
+    )
+
+
+def downgrade():
+    op.drop_table('price_rollups')
+    op.drop_index('ix_price_history_listing_time', table_name='price_history')
+    op.drop_table('price_history')
@@ -0,0 +1,27 @@
+"""Add inventory search indexes
+
+Revision ID: 352ef6dd63af
+Revises: 943e6198af15
+Create Date: 2026-10-18 10:41:03.502218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '352ef6dd63af'
+down_revision = '943e6198af15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_inventory_variety_price', 'inventory', ['variety_id', 'price'], unique=False)
+    op.create_index('ix_inventory_variety_price_in_stock', 'inventory', ['variety_id', 'price'], unique=False,
+                    postgresql_where=sa.text('count > 0'), sqlite_where=sa.text('count > 0'))
+
+
+def downgrade():
+    op.drop_index('ix_inventory_variety_price_in_stock', table_name='inventory')
+    op.drop_index('ix_inventory_variety_price', table_name='inventory')
@@ -0,0 +1,33 @@
+"""Add change events outbox
+
+Revision ID: 619291816c06
+Revises: 09eadf1e0565
+Create Date: 2026-10-18 18:05:42.731904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '619291816c06'
+down_revision = '09eadf1e0565'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_events',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('kind', sa.String(length=32), nullable=False),
+    sa.Column('farm_id', sa.Integer(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_events_created_at', 'change_events', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_change_events_created_at', table_name='change_events')
+    op.drop_table('change_events')
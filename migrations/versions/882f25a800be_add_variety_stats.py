@@ -0,0 +1,41 @@
+"""Add variety stats
+
+Revision ID: 882f25a800be
+Revises: 352ef6dd63af
+Create Date: 2026-10-18 13:05:51.730294
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '882f25a800be'
+down_revision = '352ef6dd63af'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('variety_stats',
+    sa.Column('variety_id', sa.Integer(), nullable=False),
+    sa.Column('farm_count', sa.Integer(), nullable=False),
+    sa.Column('total_count', sa.Integer(), nullable=False),
+    sa.Column('price_sum', sa.Float(), nullable=False),
+    sa.Column('min_price', sa.Float(), nullable=True),
+    sa.Column('max_price', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['variety_id'], ['varieties.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('variety_id')
+    )
+    # Backfill from the existing inventory
+    op.execute(
+        'INSERT INTO variety_stats '
+        '(variety_id, farm_count, total_count, price_sum, min_price, max_price, updated_at) '
+        'SELECT variety_id, count(*), coalesce(sum(count), 0), coalesce(sum(price), 0), '
+        'min(price), max(price), CURRENT_TIMESTAMP FROM inventory GROUP BY variety_id'
+    )
+
+
+def downgrade():
+    op.drop_table('variety_stats')
@@ -0,0 +1,30 @@
+"""Add farm coordinates and geohash
+
+Revision ID: 9469c0344236
+Revises: 619291816c06
+Create Date: 2026-10-18 19:12:27.508341
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9469c0344236'
+down_revision = '619291816c06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('farms', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('farms', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('farms', sa.Column('geohash', sa.String(length=8), nullable=True))
+    op.create_index('ix_farms_geohash', 'farms', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_farms_geohash', table_name='farms')
+    op.drop_column('farms', 'geohash')
+    op.drop_column('farms', 'longitude')
+    op.drop_column('farms', 'latitude')
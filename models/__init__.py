@@ -1,7 +1,11 @@
 from .base import db
+from .cache import CacheVersion
 from .user import User
-from .farm import Farm
+from .farm import Farm, UnknownVarieties
 from .variety import Variety
-from .inventory import Inventory
+from .inventory import Inventory, InsufficientStock
+from .variety_stats import VarietyStats
+from .price_history import PriceHistory, PriceRollup
+from .change_event import ChangeEvent
 
-__all__ = ['db', 'User', 'Farm', 'Variety', 'Inventory'] 
\ No newline at end of file
+__all__ = ['db', 'User', 'Farm', 'UnknownVarieties', 'Variety', 'Inventory', 'InsufficientStock', 'CacheVersion', 'VarietyStats', 'PriceHistory', 'PriceRollup', 'ChangeEvent'] 
\ No newline at end of file
@@ -0,0 +1,66 @@
+from sqlalchemy import delete, insert, literal, select
+from .base import db
+
+# Copies of deleted rows, keyed by their original IDs so they can be put
+# back; archived_at records when each left the live tables
+
+archived_farms = db.Table('archived_farms',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('email', db.String(120), nullable=False),
+    db.Column('phone_number', db.String(20), nullable=False),
+    db.Column('latitude', db.Float),
+    db.Column('longitude', db.Float),
+    db.Column('geohash', db.String(8)),
+    db.Column('created_at', db.DateTime),
+    db.Column('updated_at', db.DateTime),
+    db.Column('archived_at', db.DateTime, nullable=False)
+)
+
+archived_varieties = db.Table('archived_varieties',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(100), nullable=False),
+    db.Column('created_at', db.DateTime),
+    db.Column('updated_at', db.DateTime),
+    db.Column('archived_at', db.DateTime, nullable=False)
+)
+
+archived_inventory = db.Table('archived_inventory',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('farm_id', db.Integer, nullable=False, index=True),
+    db.Column('variety_id', db.Integer, nullable=False, index=True),
+    db.Column('price', db.Float, nullable=False),
+    db.Column('count', db.Integer, nullable=False),
+    db.Column('created_at', db.DateTime),
+    db.Column('updated_at', db.DateTime),
+    db.Column('archived_at', db.DateTime, nullable=False)
+)
+
+archived_farm_varieties = db.Table('archived_farm_varieties',
+    db.Column('farm_id', db.Integer, primary_key=True),
+    db.Column('variety_id', db.Integer, primary_key=True, index=True),
+    db.Column('archived_at', db.DateTime, nullable=False)
+)
+
+
+def archive_rows(archive, table, where, archived_at):
+    """Copy the rows of table matching where into its archive table in one statement"""
+    columns = [column.name for column in table.columns]
+    db.session.execute(insert(archive).from_select(
+        columns + ['archived_at'],
+        select(*table.columns, literal(archived_at)).where(where)
+    ))
+
+
+def restore_rows(archive, table, where):
+    """Move archived rows matching where back into table; returns how many moved
+
+    Raises IntegrityError if a live row has since taken a restored key.
+    """
+    columns = [column.name for column in table.columns]
+    result = db.session.execute(insert(table).from_select(
+        columns,
+        select(*(archive.c[name] for name in columns)).where(where)
+    ))
+    db.session.execute(delete(archive).where(where))
+    return result.rowcount
+
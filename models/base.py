@@ -1,11 +1,89 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from datetime import datetime
+from sqlalchemy import CompoundSelect, Select, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class RoutingSession(Session):
+    """Session that sends plain reads to the replica bind named in info['replica']
+
+    Flushes, INSERT/UPDATE/DELETE and SELECT ... FOR UPDATE always use the
+    primary, and the first of them clears the replica so the rest of the
+    session reads what it wrote. Reads filling process-wide caches pass
+    bind_arguments=on_primary(), since a lagging replica would leave them
+    stale for every later request. Without info['replica'] every statement
+    goes to the primary as usual.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None:
+            if self._flushing or isinstance(clause, UpdateBase) or getattr(clause, '_for_update_arg', None) is not None:
+                self.info['replica'] = None
+            elif isinstance(clause, (Select, CompoundSelect)):
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Initialize SQLAlchemy
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def on_primary():
+    """bind_arguments keeping a read on the primary while the session routes to a replica"""
+    return {'bind': db.engine}
 
 # Association table for Farm-Variety many-to-many relationship
 farm_variety = db.Table('farm_variety',
     db.Column('farm_id', db.Integer, db.ForeignKey('farms.id'), primary_key=True),
-    db.Column('variety_id', db.Integer, db.ForeignKey('varieties.id'), primary_key=True)
-) 
\ No newline at end of file
+    db.Column('variety_id', db.Integer, db.ForeignKey('varieties.id'), primary_key=True),
+    # The primary key serves lookups by farm; this one serves deletes by variety
+    db.Index('ix_farm_variety_variety_id', 'variety_id')
+)
+
+
+def upsert(table, index_elements, set_):
+    """Build an INSERT that updates the existing row on a unique conflict
+
+    set_ is called with the incoming-row namespace (EXCLUDED, or INSERTED on
+    MySQL) and returns the column values to assign when the row exists.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update(set_(stmt.inserted))
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_(stmt.excluded))
+
+
+def insert_missing(table, index_elements):
+    """Build an INSERT that skips rows conflicting on index_elements, so rowcount counts new rows
+
+    MySQL spells it INSERT IGNORE, which also skips rows failing other checks.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        return mysql.insert(table).prefix_with('IGNORE')
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    return insert(table).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def page_query(key, after_id=None, limit=50):
+    """Query one page of rows ordered by the key column after after_id, plus one to detect more"""
+    query = key.class_.query.order_by(key)
+    if after_id is not None:
+        query = query.filter(key > after_id)
+    return query.limit(limit + 1)
+
+
+def least(a, b):
+    """SQL LEAST of two values; SQLite spells it as the multi-argument min()"""
+    return func.min(a, b) if db.session.get_bind().dialect.name == 'sqlite' else func.least(a, b)
+
+
+def greatest(a, b):
+    """SQL GREATEST of two values; SQLite spells it as the multi-argument max()"""
+    return func.max(a, b) if db.session.get_bind().dialect.name == 'sqlite' else func.greatest(a, b)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from .base import db, on_primary, upsert
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def get_version(cls, name):
+        """Get the current version of a named cache, 0 if it was never bumped"""
+        return db.session.execute(select(cls.version).where(cls.name == name), bind_arguments=on_primary()).scalar() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """Increment a named cache version as part of the current transaction"""
+        stmt = upsert(cls.__table__, ['name'], lambda incoming: {
+            'version': cls.__table__.c.version + 1
+        })
+        db.session.execute(stmt, {'name': name, 'version': 1})
+
+
+class CatalogCache:
+    """Process-local LRU cache of catalog entries keyed by ID and name
+
+    Entries expire after ttl seconds. Other workers invalidate this one by
+    bumping the named CacheVersion, which is checked at most once every
+    version_interval seconds. Fills take a generation() before reading rows
+    and hand it to put, which drops the entry if the cache was invalidated
+    in between.
+    """
+
+    def __init__(self, name, ttl=300, maxsize=10000, version_interval=5):
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._ids_by_name = {}
+        self._version = None
+        self._version_checked_at = 0
+        self._generation = 0
+        self.configure(ttl, maxsize, version_interval)
+
+    def configure(self, ttl, maxsize, version_interval):
+        """Apply new limits and drop everything cached so far"""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version_interval = version_interval
+        self.clear()
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+            self._ids_by_name.clear()
+            self._version = None
+            self._version_checked_at = 0
+            self._generation += 1
+
+    def get(self, entry_id):
+        """Get a cached entry by ID, or None on a miss"""
+        self._check_version()
+        with self._lock:
+            cached = self._entries.get(entry_id)
+            if cached is None:
+                return None
+            expires_at, name, entry = cached
+            if expires_at < time.monotonic():
+                self._remove(entry_id)
+                return None
+            self._entries.move_to_end(entry_id)
+            return entry
+
+    def get_id(self, name):
+        """Get the ID cached for a name, or None on a miss"""
+        with self._lock:
+            entry_id = self._ids_by_name.get(name)
+        if entry_id is not None and self.get(entry_id) is not None:
+            return entry_id
+        return None
+
+    def generation(self):
+        """Check the version and get the generation to put entries read from now on under"""
+        self._check_version()
+        with self._lock:
+            return self._generation
+
+    def put(self, entry_id, name, entry, generation):
+        """Cache an entry under its ID and name, unless it was invalidated since generation"""
+        with self._lock:
+            # A write may have committed after the entry was read
+            if generation != self._generation:
+                return entry
+            self._remove(entry_id)
+            self._entries[entry_id] = (time.monotonic() + self.ttl, name, entry)
+            self._ids_by_name[name] = entry_id
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, entry_id):
+        """Drop a single entry from this process"""
+        with self._lock:
+            self._remove(entry_id)
+            self._generation += 1
+
+    def bump(self):
+        """Invalidate the cache in every worker; call before committing a write"""
+        CacheVersion.bump(self.name)
+
+    def _remove(self, entry_id):
+        cached = self._entries.pop(entry_id, None)
+        if cached is not None and self._ids_by_name.get(cached[1]) == entry_id:
+            del self._ids_by_name[cached[1]]
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_interval:
+            return
+        version = CacheVersion.get_version(self.name)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._ids_by_name.clear()
+                self._version = version
+                self._generation += 1
+            self._version_checked_at = now
+
+
+variety_cache = CatalogCache('varieties')
@@ -0,0 +1,21 @@
+import json
+from datetime import datetime
+from .base import db
+
+class ChangeEvent(db.Model):
+    """Outbox row for a committed change, read by the database change feed bus"""
+    __tablename__ = 'change_events'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    farm_id = db.Column(db.Integer)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def to_event(self):
+        return {'id': self.id, 'kind': self.kind, 'farm_id': self.farm_id, 'data': json.loads(self.payload)}
+
+
+def stage_change(kind, farm_id, data):
+    """Queue a change event on the current session, published if and when it commits"""
+    db.session.info.setdefault('pending_changes', []).append({'kind': kind, 'farm_id': farm_id, 'data': data})
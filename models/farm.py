@@ -1,12 +1,33 @@
 from datetime import datetime
-from .base import db, farm_variety
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from .base import db, farm_variety, insert_missing
+from .variety import Variety
+from .inventory import Inventory
+from .variety_stats import VarietyStats
+from .archive import archive_rows, archived_farm_varieties, archived_farms, archived_inventory, restore_rows
+from .change_event import stage_change
+from . import geo
+
+class UnknownVarieties(Exception):
+    """Raised when a farm is asked to grow varieties that do not exist"""
+
+    def __init__(self, variety_ids):
+        super().__init__('Unknown variety IDs: %s' % ', '.join(map(str, variety_ids)))
+        self.variety_ids = variety_ids
 
 class Farm(db.Model):
     __tablename__ = 'farms'
+    # Archived farms keep their IDs, so SQLite must not hand them out again
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone_number = db.Column(db.String(20), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Derived from the coordinates by locate(); prefix ranges find nearby farms
+    geohash = db.Column(db.String(geo.PRECISION), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -16,25 +37,64 @@ class Farm(db.Model):
                               lazy='dynamic')
     inventory_items = db.relationship('Inventory', backref='farm', lazy='dynamic')
 
-    def to_dict(self):
+    def to_dict(self, varieties=None, inventory_items=None):
+        if varieties is None:
+            varieties = self.varieties
+        if inventory_items is None:
+            inventory_items = self.inventory_items
         return {
             'id': self.id,
             'email': self.email,
             'phone_number': self.phone_number,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'varieties': [variety.to_dict() for variety in self.varieties],
-            'inventory': [item.to_dict() for item in self.inventory_items]
+            'varieties': [variety.to_dict() for variety in varieties],
+            'inventory': [item.to_dict() for item in inventory_items]
         }
 
     @classmethod
-    def create_farm(cls, email, phone_number):
+    def to_detail_dicts(cls, farms):
+        """Serialize farms with their varieties and inventory in a fixed number of queries"""
+        farm_ids = [farm.id for farm in farms]
+        varieties = {farm_id: [] for farm_id in farm_ids}
+        inventory_items = {farm_id: [] for farm_id in farm_ids}
+        if farm_ids:
+            variety_rows = db.session.query(farm_variety.c.farm_id, Variety) \
+                .join(Variety, Variety.id == farm_variety.c.variety_id) \
+                .filter(farm_variety.c.farm_id.in_(farm_ids)) \
+                .order_by(Variety.id)
+            # Not cached from here: these may come from a replica
+            for farm_id, variety in variety_rows:
+                varieties[farm_id].append(variety)
+
+            items = Inventory.query.filter(Inventory.farm_id.in_(farm_ids)).order_by(Inventory.id).all()
+            Variety.prime_cache(item.variety_id for item in items)
+            for item in items:
+                inventory_items[item.farm_id].append(item)
+
+        return [
+            farm.to_dict(varieties=varieties[farm.id], inventory_items=inventory_items[farm.id])
+            for farm in farms
+        ]
+
+    def locate(self, latitude, longitude):
+        """Set the farm's coordinates, or clear them with None"""
+        self.latitude, self.longitude = latitude, longitude
+        self.geohash = geo.encode(latitude, longitude) if latitude is not None and longitude is not None else None
+
+    @classmethod
+    def create_farm(cls, email, phone_number, latitude=None, longitude=None):
         """Create a new farm"""
         farm = cls(
             email=email,
             phone_number=phone_number
         )
+        farm.locate(latitude, longitude)
         db.session.add(farm)
+        db.session.flush()
+        stage_change('farm', farm.id, {'farm_id': farm.id, 'action': 'created'})
         db.session.commit()
         return farm
 
@@ -43,6 +103,80 @@ class Farm(db.Model):
         """Get farm by ID"""
         return cls.query.get(farm_id)
 
+    @classmethod
+    def get_detail(cls, farm_id):
+        """Get a farm serialized with its varieties and inventory, or None"""
+        farm = cls.get_by_id(farm_id)
+        if farm is None:
+            return None
+        return cls.to_detail_dicts([farm])[0]
+
+    @classmethod
+    def get_details(cls, farm_ids):
+        """Get a dict of farm ID to serialized detail for the farms that exist"""
+        farms = db.session.scalars(select(cls).where(cls.id.in_(set(farm_ids)))).all()
+        return {farm['id']: farm for farm in cls.to_detail_dicts(farms)}
+
+    @classmethod
+    def get_version(cls, farm_id):
+        """Get the values that change whenever the farm's detail dict does, or None
+
+        Covers the farm row, its inventory rows (including deletions), its
+        variety links and the varieties nested in the body, in one query.
+        """
+        farm_variety_ids = select(farm_variety.c.variety_id).where(farm_variety.c.farm_id == farm_id)
+        inventory_variety_ids = select(Inventory.variety_id).where(Inventory.farm_id == farm_id)
+        row = db.session.execute(
+            select(
+                cls.id,
+                cls.updated_at,
+                select(func.max(Inventory.updated_at)).where(Inventory.farm_id == farm_id).scalar_subquery(),
+                select(func.count()).select_from(Inventory).where(Inventory.farm_id == farm_id).scalar_subquery(),
+                select(func.count()).select_from(farm_variety).where(farm_variety.c.farm_id == farm_id).scalar_subquery(),
+                select(func.max(Variety.updated_at)).where(or_(
+                    Variety.id.in_(farm_variety_ids),
+                    Variety.id.in_(inventory_variety_ids)
+                )).scalar_subquery()
+            ).where(cls.id == farm_id)
+        ).first()
+        return tuple(row) if row else None
+
+    @classmethod
+    def nearby(cls, latitude, longitude, radius_km, variety_id=None, limit=20, use_index=True):
+        """Get up to limit (farm, distance_km) pairs within radius_km, nearest first
+
+        With variety_id, only farms with that variety in stock count. The
+        geohash index narrows the search to a few cells around the point
+        before exact distances are computed; use_index=False scans every
+        located farm instead, as a baseline.
+        """
+        query = select(cls.id, cls.latitude, cls.longitude)
+        if use_index:
+            ranges = []
+            for prefix in geo.covering_prefixes(latitude, longitude, radius_km):
+                upper = geo.prefix_upper_bound(prefix)
+                ranges.append(and_(cls.geohash >= prefix, cls.geohash < upper) if upper else cls.geohash >= prefix)
+            query = query.where(or_(*ranges))
+        else:
+            query = query.where(cls.geohash.isnot(None))
+        if variety_id is not None:
+            query = query.where(select(Inventory.id).where(
+                Inventory.farm_id == cls.id,
+                Inventory.variety_id == variety_id,
+                Inventory.count > 0
+            ).exists())
+
+        nearest = sorted(
+            (distance, farm_id)
+            for farm_id, distance in (
+                (farm_id, geo.distance_km(latitude, longitude, farm_latitude, farm_longitude))
+                for farm_id, farm_latitude, farm_longitude in db.session.execute(query)
+            )
+            if distance <= radius_km
+        )[:limit]
+        farms = {farm.id: farm for farm in db.session.scalars(select(cls).where(cls.id.in_([farm_id for _, farm_id in nearest])))}
+        return [(farms[farm_id], distance) for distance, farm_id in nearest if farm_id in farms]
+
     @classmethod
     def get_by_email(cls, email):
         """Get farm by email"""
@@ -53,26 +187,130 @@ class Farm(db.Model):
         """Update farm fields"""
         farm = cls.get_by_id(farm_id)
         if farm:
+            if 'latitude' in kwargs or 'longitude' in kwargs:
+                farm.locate(kwargs.pop('latitude', farm.latitude), kwargs.pop('longitude', farm.longitude))
             for key, value in kwargs.items():
                 if hasattr(farm, key):
                     setattr(farm, key, value)
+            stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'updated'})
             db.session.commit()
         return farm
 
     @classmethod
-    def delete_farm(cls, farm_id):
-        """Delete farm by ID"""
-        farm = cls.get_by_id(farm_id)
-        if farm:
-            db.session.delete(farm)
+    def delete_farm(cls, farm_id, archive=False):
+        """Delete a farm with its inventory and variety links in a few set-based statements
+
+        No rows are loaded into Python, so memory stays flat however much
+        inventory the farm has. With archive the rows are first copied into
+        the archive tables, from which restore_farm puts them back; raises
+        IntegrityError if an archived copy already holds one of their keys.
+        """
+        if db.session.execute(select(cls.id).where(cls.id == farm_id).with_for_update()).first() is None:
+            return False
+        listings = Inventory.farm_id == farm_id
+        links = farm_variety.c.farm_id == farm_id
+        try:
+            VarietyStats.remove_listings(listings)
+            if archive:
+                now = datetime.utcnow()
+                archive_rows(archived_inventory, Inventory.__table__, listings, now)
+                archive_rows(archived_farm_varieties, farm_variety, links, now)
+                archive_rows(archived_farms, cls.__table__, cls.id == farm_id, now)
+            db.session.execute(delete(Inventory.__table__).where(listings))
+            db.session.execute(delete(farm_variety).where(links))
+            db.session.execute(delete(cls.__table__).where(cls.id == farm_id))
+            stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'archived' if archive else 'deleted'})
             db.session.commit()
-            return True
-        return False
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        return True
+
+    @classmethod
+    def restore_farm(cls, farm_id):
+        """Put an archived farm back with its inventory and variety links, or return None
+
+        Archived rows for varieties deleted since stay archived until the
+        variety is restored too. Raises IntegrityError if the farm's ID or
+        email was taken meanwhile.
+        """
+        try:
+            if not restore_rows(archived_farms, cls.__table__, archived_farms.c.id == farm_id):
+                return None
+            restore_rows(archived_inventory, Inventory.__table__, and_(
+                archived_inventory.c.farm_id == farm_id,
+                select(Variety.id).where(Variety.id == archived_inventory.c.variety_id).exists()
+            ))
+            restore_rows(archived_farm_varieties, farm_variety, and_(
+                archived_farm_varieties.c.farm_id == farm_id,
+                select(Variety.id).where(Variety.id == archived_farm_varieties.c.variety_id).exists()
+            ))
+            VarietyStats.add_listings(Inventory.farm_id == farm_id)
+            # Links to varieties deleted since stay behind, so the detail is not what it was
+            cls.touch([farm_id])
+            stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'restored'})
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        return cls.get_by_id(farm_id)
+
+    @classmethod
+    def touch(cls, farm_ids):
+        """Move updated_at forward on farms whose detail changed without a newer row to show it
+
+        Last-Modified is the newest timestamp behind the detail, so removing
+        a row would otherwise leave it unchanged. farm_ids may be a select.
+        """
+        db.session.execute(update(cls).where(cls.id.in_(farm_ids)).values(updated_at=datetime.utcnow()),
+                           execution_options={'synchronize_session': False})
+
+    @classmethod
+    def set_varieties(cls, farm_id, variety_ids):
+        """Make the farm grow exactly variety_ids in one transaction
+
+        Returns (added, removed) counts, or None if the farm does not exist;
+        raises UnknownVarieties if any ID is not a variety.
+        """
+        variety_ids = set(variety_ids)
+        # Lock the farm so concurrent syncs of the same farm apply one after another
+        if db.session.execute(select(cls.id).where(cls.id == farm_id).with_for_update()).first() is None:
+            return None
+
+        # One query tells which wanted varieties exist and which are already linked
+        linked = farm_variety.c.variety_id.isnot(None)
+        rows = db.session.execute(
+            select(Variety.id, linked)
+            .outerjoin(farm_variety, and_(farm_variety.c.variety_id == Variety.id,
+                                          farm_variety.c.farm_id == farm_id))
+            .where(Variety.id.in_(variety_ids))
+        ).all()
+        unknown = variety_ids - {variety_id for variety_id, _ in rows}
+        if unknown:
+            db.session.rollback()
+            raise UnknownVarieties(sorted(unknown))
+
+        to_add = [{'farm_id': farm_id, 'variety_id': variety_id} for variety_id, is_linked in rows if not is_linked]
+        added = 0
+        if to_add:
+            # FOR UPDATE is a no-op on SQLite, so a concurrent sync may have linked some already
+            added = db.session.execute(insert_missing(farm_variety, ['farm_id', 'variety_id']), to_add).rowcount
+        removed = db.session.execute(
+            delete(farm_variety).where(farm_variety.c.farm_id == farm_id,
+                                       farm_variety.c.variety_id.notin_(variety_ids))
+        ).rowcount
+        if added or removed:
+            cls.touch([farm_id])
+            stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'varieties'})
+        db.session.commit()
+        return added, removed
 
     def add_variety(self, variety):
         """Add a variety to the farm"""
         if variety not in self.varieties:
             self.varieties.append(variety)
+            self.updated_at = datetime.utcnow()
+            stage_change('farm', self.id, {'farm_id': self.id, 'action': 'varieties'})
             db.session.commit()
             return True
         return False
@@ -81,6 +319,8 @@ class Farm(db.Model):
         """Remove a variety from the farm"""
         if variety in self.varieties:
             self.varieties.remove(variety)
+            self.updated_at = datetime.utcnow()
+            stage_change('farm', self.id, {'farm_id': self.id, 'action': 'varieties'})
             db.session.commit()
             return True
         return False 
\ No newline at end of file
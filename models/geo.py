@@ -0,0 +1,88 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Stored geohash length (cells about 38 m by 19 m)
+PRECISION = 8
+
+# A search covers its bounding box with at most this many geohash cells
+MAX_CELLS = 32
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point; nearby points share long prefixes"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    longitude = (longitude + 180) % 360 - 180
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        target, span = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (span[0] + span[1]) / 2
+        if target >= middle:
+            value = value * 2 + 1
+            span[0] = middle
+        else:
+            value = value * 2
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell"""
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** (5 * precision - lat_bits)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance by the haversine formula"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together cover every point within radius_km
+
+    Uses the longest prefixes for which the circle's bounding box spans no
+    more than MAX_CELLS cells, so candidates stay few without many ranges.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, latitude - dlat), min(90.0, latitude + dlat)
+    widest = max(abs(south), abs(north))
+    if widest >= 90 or dlat >= 90:
+        dlon = 180.0
+    else:
+        dlon = min(180.0, dlat / math.cos(math.radians(widest)))
+    west, east = longitude - dlon, longitude + dlon
+
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        columns = min(math.floor(east / width) - math.floor(west / width) + 1, round(360 / width))
+        if rows * columns <= MAX_CELLS or precision == 1:
+            break
+    prefixes = set()
+    for row in range(rows):
+        cell_lat = min(south + row * height, north)
+        for column in range(columns):
+            prefixes.add(encode(cell_lat, min(west + column * width, east), precision))
+        prefixes.add(encode(cell_lat, east, precision))
+    for column in range(columns):
+        prefixes.add(encode(north, min(west + column * width, east), precision))
+    prefixes.add(encode(north, east, precision))
+    return sorted(prefixes)
+
+
+def prefix_upper_bound(prefix):
+    """The smallest geohash after every geohash starting with prefix, or None"""
+    prefix = prefix.rstrip(BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
@@ -1,5 +1,18 @@
 from datetime import datetime
-from .base import db
+from sqlalchemy import bindparam, literal_column, select, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from .base import db, insert_missing
+from .variety import Variety
+from .variety_stats import VarietyStats
+from .price_history import PriceHistory
+from .change_event import stage_change
+
+class InsufficientStock(Exception):
+    """Raised when a reservation would take an inventory count below zero"""
+
+    def __init__(self, inventory_id):
+        super().__init__('Insufficient stock for inventory item %s' % inventory_id)
+        self.inventory_id = inventory_id
 
 class Inventory(db.Model):
     __tablename__ = 'inventory'
@@ -12,9 +25,15 @@ class Inventory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    # Ensure unique combination of farm and variety
+    # Ensure unique combination of farm and variety; the variety/price
+    # indexes serve search, the partial one only covers rows in stock.
+    # Archived items keep their IDs, so SQLite must not hand them out again
     __table_args__ = (
         db.UniqueConstraint('farm_id', 'variety_id', name='uix_farm_variety'),
+        db.Index('ix_inventory_variety_price', 'variety_id', 'price'),
+        db.Index('ix_inventory_variety_price_in_stock', 'variety_id', 'price',
+                 postgresql_where=count > 0, sqlite_where=count > 0),
+        {'sqlite_autoincrement': True}
     )
 
     def to_dict(self):
@@ -26,7 +45,7 @@ class Inventory(db.Model):
             'count': self.count,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'variety': self.variety.to_dict()
+            'variety': Variety.get_cached_dict(self.variety_id)
         }
 
     @classmethod
@@ -39,48 +58,290 @@ class Inventory(db.Model):
             count=count
         )
         db.session.add(inventory_item)
+        db.session.flush()
+        cls._record_changes([(inventory_item.id, farm_id, variety_id, None, (price, count))])
         db.session.commit()
         return inventory_item
 
+    @classmethod
+    def bulk_upsert(cls, rows):
+        """Insert or update many items on uix_farm_variety and commit
+
+        rows is a list of (line, values) pairs where values holds farm_id,
+        variety_id, price and count. Returns (upserted, errors) where errors is
+        a list of (line, message) for rows that could not be written.
+        """
+        from .farm import Farm
+
+        errors = []
+        farm_ids = {values['farm_id'] for _, values in rows}
+        variety_ids = {values['variety_id'] for _, values in rows}
+        known_farms = set(db.session.scalars(select(Farm.id).where(Farm.id.in_(farm_ids))))
+        known_varieties = set(db.session.scalars(select(Variety.id).where(Variety.id.in_(variety_ids))))
+
+        # A key may appear once per statement, so the last row for it wins
+        latest = {}
+        for line, values in rows:
+            if values['farm_id'] not in known_farms:
+                errors.append((line, 'Unknown farm_id %s' % values['farm_id']))
+            elif values['variety_id'] not in known_varieties:
+                errors.append((line, 'Unknown variety_id %s' % values['variety_id']))
+            else:
+                latest[(values['farm_id'], values['variety_id'])] = (line, values)
+        if not latest:
+            return 0, errors
+
+        now = datetime.utcnow()
+        params = {key: dict(values, created_at=now, updated_at=now) for key, (_, values) in latest.items()}
+        try:
+            cls._record_changes(cls._upsert_rows(params, now))
+            db.session.commit()
+            return len(params), errors
+        except (DBAPIError, OverflowError):
+            db.session.rollback()
+
+        # Something changed underneath us; isolate the offending rows one by one
+        upserted = 0
+        for key, (line, _) in latest.items():
+            try:
+                with db.session.begin_nested():
+                    cls._record_changes(cls._upsert_rows({key: params[key]}, now))
+                upserted += 1
+            except (DBAPIError, OverflowError) as e:
+                # Constraint failures and values the column cannot hold (SQLite's driver
+                # raises OverflowError itself) fail only their own row
+                errors.append((line, str(getattr(e, 'orig', e))))
+        db.session.commit()
+        return upserted, errors
+
+    @classmethod
+    def _upsert_rows(cls, params, now):
+        """Write rows of values keyed by (farm_id, variety_id) and return their changes
+
+        New keys are inserted first, which also takes the write lock on
+        SQLite, and that INSERT reports which keys it wrote. The other rows
+        are read under that lock or FOR UPDATE, so the old values fed to the
+        stats are the ones being replaced.
+        """
+        changes = []
+        pending = dict(params)
+        # A row deleted between the INSERT and the locked read needs inserting again
+        while pending:
+            waiting = len(pending)
+            inserted = cls._insert_missing(list(pending.values()))
+            rows = db.session.execute(
+                select(cls.id, cls.farm_id, cls.variety_id, cls.price, cls.count)
+                .where(cls.farm_id.in_({farm_id for farm_id, _ in pending}),
+                       cls.variety_id.in_({variety_id for _, variety_id in pending}))
+                .with_for_update()
+            )
+            updates = []
+            for row in rows:
+                key = (row.farm_id, row.variety_id)
+                if key not in pending:
+                    continue
+                values = pending.pop(key)
+                new = (values['price'], values['count'])
+                if key in inserted:
+                    changes.append((row.id, row.farm_id, row.variety_id, None, new))
+                else:
+                    updates.append({'row_id': row.id, 'row_price': new[0], 'row_count': new[1]})
+                    changes.append((row.id, row.farm_id, row.variety_id, (row.price, row.count), new))
+            if updates:
+                db.session.execute(
+                    update(cls.__table__).where(cls.id == bindparam('row_id'))
+                    .values(price=bindparam('row_price'), count=bindparam('row_count'), updated_at=now),
+                    updates
+                )
+            if len(pending) == waiting:
+                # Skipped yet absent, e.g. MySQL's IGNORE passing over a farm deleted meanwhile
+                raise IntegrityError('INSERT', list(pending.values()), Exception('Row could not be written'))
+        return changes
+
+    @classmethod
+    def _insert_missing(cls, params):
+        """Insert the rows whose (farm_id, variety_id) is new and return those keys"""
+        stmt = insert_missing(cls.__table__, ['farm_id', 'variety_id'])
+        if db.session.get_bind().dialect.insert_executemany_returning:
+            return set(db.session.execute(stmt.returning(cls.farm_id, cls.variety_id), params).tuples())
+        # No RETURNING (MySQL): one row per statement, so rowcount tells them apart
+        return {(values['farm_id'], values['variety_id']) for values in params
+                if db.session.execute(stmt, values).rowcount}
+
     @classmethod
     def get_by_id(cls, inventory_id):
         """Get inventory item by ID"""
         return cls.query.get(inventory_id)
 
+    @classmethod
+    def search(cls, variety_id, min_price=None, max_price=None, min_count=0, limit=50):
+        """Get items of a variety within a price range and with enough stock, cheapest first"""
+        query = cls.query.filter(cls.variety_id == variety_id)
+        if min_price is not None:
+            query = query.filter(cls.price >= min_price)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        if min_count > 0:
+            # Spelled out so planners can match the partial in-stock index
+            query = query.filter(cls.count > literal_column('0'), cls.count >= min_count)
+        items = query.order_by(cls.price, cls.id).limit(limit).all()
+        Variety.prime_cache([variety_id])
+        return items
+
+    @classmethod
+    def get_version(cls, inventory_id):
+        """Get the values that change whenever the item's to_dict() does, or None"""
+        row = db.session.execute(
+            select(cls.id, cls.updated_at, cls.variety_id).where(cls.id == inventory_id)
+        ).first()
+        if row is None:
+            return None
+        return tuple(row) + (Variety.get_version(row.variety_id) or ())
+
     @classmethod
     def get_by_farm_and_variety(cls, farm_id, variety_id):
         """Get inventory item by farm and variety"""
         return cls.query.filter_by(farm_id=farm_id, variety_id=variety_id).first()
 
+    @classmethod
+    def to_dicts(cls, items):
+        """Serialize items, loading their varieties with at most one query"""
+        Variety.prime_cache(item.variety_id for item in items)
+        return [item.to_dict() for item in items]
+
     @classmethod
     def update_inventory_item(cls, inventory_id, **kwargs):
         """Update inventory item fields"""
-        item = cls.get_by_id(inventory_id)
+        from .farm import Farm
+
+        item = cls._lock_item(inventory_id)
         if item:
+            old_farm_id, old_variety_id, old = item.farm_id, item.variety_id, (item.price, item.count)
             for key, value in kwargs.items():
                 if hasattr(item, key):
                     setattr(item, key, value)
+            db.session.flush()
+            new = (item.price, item.count)
+            if (item.farm_id, item.variety_id) == (old_farm_id, old_variety_id):
+                cls._record_changes([(item.id, item.farm_id, item.variety_id, old, new)])
+            else:
+                cls._record_changes([(item.id, old_farm_id, old_variety_id, old, None),
+                                     (item.id, item.farm_id, item.variety_id, None, new)])
+                if item.farm_id != old_farm_id:
+                    Farm.touch([old_farm_id])
             db.session.commit()
         return item
 
     @classmethod
     def delete_inventory_item(cls, inventory_id):
         """Delete inventory item by ID"""
-        item = cls.get_by_id(inventory_id)
+        from .farm import Farm
+
+        item = cls._lock_item(inventory_id)
         if item:
+            farm_id, variety_id, old = item.farm_id, item.variety_id, (item.price, item.count)
             db.session.delete(item)
+            db.session.flush()
+            cls._record_changes([(inventory_id, farm_id, variety_id, old, None)])
+            Farm.touch([farm_id])
             db.session.commit()
             return True
         return False
 
+    @classmethod
+    def _lock_item(cls, inventory_id):
+        """Load an item locked and refreshed, so its values are the ones a change replaces, or None"""
+        # FOR UPDATE is a no-op on SQLite, where writing first takes the lock instead;
+        # setting updated_at to itself keeps its onupdate, and so the ETag, unchanged
+        if db.session.get_bind().dialect.name == 'sqlite':
+            db.session.execute(update(cls).where(cls.id == inventory_id).values(updated_at=cls.updated_at),
+                               execution_options={'synchronize_session': False})
+        return cls.query.filter_by(id=inventory_id).populate_existing().with_for_update().first()
+
+    @classmethod
+    def _adjust_count(cls, inventory_id, count_change):
+        """Add count_change in a single conditional UPDATE
+
+        Returns the (id, count, farm_id, variety_id, price) row after the change, or None.
+        """
+        stmt = update(cls) \
+            .where(cls.id == inventory_id, cls.count + count_change >= 0) \
+            .values(count=cls.count + count_change)
+        options = {'synchronize_session': False}
+        columns = (cls.id, cls.count, cls.farm_id, cls.variety_id, cls.price)
+        if db.session.get_bind().dialect.update_returning:
+            return db.session.execute(stmt.returning(*columns), execution_options=options).first()
+        # No RETURNING (MySQL): the row stays locked by our UPDATE, so re-reading it is safe
+        if db.session.execute(stmt, execution_options=options).rowcount != 1:
+            return None
+        return db.session.execute(select(*columns).where(cls.id == inventory_id)).first()
+
     @classmethod
     def update_count(cls, inventory_id, count_change):
         """Update the count of an inventory item"""
-        item = cls.get_by_id(inventory_id)
-        if item:
-            new_count = item.count + count_change
-            if new_count >= 0:  # Prevent negative inventory
-                item.count = new_count
-                db.session.commit()
-                return True
-        return False 
\ No newline at end of file
+        row = cls._adjust_count(inventory_id, count_change)
+        if row is None:
+            return False  # Missing item or would go negative
+        cls._record_stock_changes([(row, count_change)])
+        db.session.commit()
+        return True
+
+    @classmethod
+    def reserve_items(cls, quantities):
+        """Decrement several items in one transaction, all or nothing
+
+        quantities is an iterable of (inventory_id, quantity) pairs. Returns a
+        dict of inventory_id to remaining count, or raises InsufficientStock.
+        """
+        totals = {}
+        for inventory_id, quantity in quantities:
+            if quantity <= 0:
+                raise ValueError('Quantity must be positive')
+            totals[inventory_id] = totals.get(inventory_id, 0) + quantity
+
+        remaining = {}
+        stock_changes = []
+        # Lock rows in a fixed order so concurrent orders cannot deadlock
+        for inventory_id in sorted(totals):
+            row = cls._adjust_count(inventory_id, -totals[inventory_id])
+            if row is None:
+                db.session.rollback()
+                raise InsufficientStock(inventory_id)
+            remaining[inventory_id] = row.count
+            stock_changes.append((row, -totals[inventory_id]))
+        cls._record_stock_changes(stock_changes)
+        db.session.commit()
+        return remaining
+
+    @classmethod
+    def _record_changes(cls, changes):
+        """Feed written rows to the variety stats, price history and change feed
+
+        changes is a list of (inventory_id, farm_id, variety_id, old, new) with
+        old and new (price, count) tuples, or None for an inserted or deleted row.
+        """
+        VarietyStats.record_changes((variety_id, old, new) for _, _, variety_id, old, new in changes)
+        changed = [change for change in changes if change[4] != change[3]]
+        PriceHistory.record(
+            (farm_id, variety_id) + new
+            for _, farm_id, variety_id, old, new in changed if new is not None
+        )
+        for inventory_id, farm_id, variety_id, old, new in changed:
+            data = {'id': inventory_id, 'farm_id': farm_id, 'variety_id': variety_id}
+            if new is None:
+                data['deleted'] = True
+            else:
+                data['price'], data['count'] = new
+            stage_change('inventory', farm_id, data)
+
+    @classmethod
+    def _record_stock_changes(cls, changes):
+        """Like _record_changes for (row, count_change) pairs from _adjust_count"""
+        changes = [(row, count_change) for row, count_change in changes if count_change]
+        VarietyStats.record_stock_changes((row.variety_id, count_change) for row, count_change in changes)
+        PriceHistory.record((row.farm_id, row.variety_id, row.price, row.count) for row, _ in changes)
+        for row, _ in changes:
+            stage_change('inventory', row.farm_id, {
+                'id': row.id, 'farm_id': row.farm_id, 'variety_id': row.variety_id,
+                'price': row.price, 'count': row.count
+            })
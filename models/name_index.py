@@ -0,0 +1,230 @@
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from operator import itemgetter
+from .base import db, on_primary
+from .cache import CacheVersion
+
+_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+# Candidates examined per requested suggestion before the run is cut off
+SCAN_FACTOR = 10
+
+# Trigram posting entries read per query gram; a typo in a word thousands of
+# names share then only weighs the lowest IDs, which tie on score anyway
+MAX_POSTINGS = 500
+
+
+def normalize(text):
+    """Fold case and accents and turn punctuation into single spaces"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def trigrams(text):
+    """Trigrams of each word, the first padded so word starts weigh in"""
+    grams = set()
+    for word in text.split():
+        word = ' ' + word
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class NameIndex:
+    """Process-local prefix and trigram index of catalog names for suggestions
+
+    Built from the database on first use and kept current by this process's
+    writes through add and remove. Writes by other workers bump the named
+    CacheVersion, checked at most once every version_interval seconds, and
+    trigger a rebuild while the old index keeps serving. Callers arriving
+    during the first build get no suggestions rather than building too.
+    """
+
+    def __init__(self, name, query, version_interval=5):
+        self.name = name
+        self.query = query
+        self.version_interval = version_interval
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._names = None
+        self._keys = []
+        self._key_ids = []
+        self._postings = {}
+        self._version = None
+        self._local_writes = 0
+        self._version_checked_at = 0
+
+    def configure(self, version_interval):
+        """Apply a new version check interval and drop the index"""
+        self.version_interval = version_interval
+        with self._lock:
+            self._reset()
+
+    def add(self, entry_id, name):
+        """Index a name this process just committed"""
+        with self._lock:
+            if self._names is None:
+                return
+            self._remove(entry_id)
+            self._add(entry_id, name)
+            self._local_writes += 1
+
+    def remove(self, entry_id):
+        """Drop a name this process just deleted"""
+        with self._lock:
+            if self._names is None:
+                return
+            self._remove(entry_id)
+            self._local_writes += 1
+
+    def suggest(self, text, limit=10):
+        """Get up to limit (id, name) pairs best matching what a user typed
+
+        Whole-name prefixes rank first, then prefixes of later words, then
+        names sharing at least half of the query's trigrams, which tolerates
+        typos. Within a rank more shared trigrams and shorter names win.
+        """
+        query = normalize(text)
+        if not query:
+            return []
+        self._refresh()
+        with self._lock:
+            if self._names is None:
+                return []
+            scored = self._prefix_matches(query, limit)
+            if len(scored) < limit:
+                self._fuzzy_matches(query, limit, scored)
+            best = sorted(scored.items(), key=lambda item: item[1])[:limit]
+            return [(entry_id, self._names[entry_id][0]) for entry_id, _ in best]
+
+    def _prefix_matches(self, query, limit):
+        # Keys sort alphabetically, so scanning a bounded run favours short names
+        scored = {}
+        start = bisect.bisect_left(self._keys, query)
+        for position in range(start, min(start + limit * SCAN_FACTOR, len(self._keys))):
+            key = self._keys[position]
+            if not key.startswith(query):
+                break
+            entry_id = self._key_ids[position]
+            normalized = self._names[entry_id][1]
+            rank = 0 if normalized == query else 1 if key == normalized else 2
+            score = (rank, 0, len(normalized), normalized)
+            if score < scored.get(entry_id, (3,)):
+                scored[entry_id] = score
+        return scored
+
+    def _fuzzy_matches(self, query, limit, scored):
+        grams = trigrams(query)
+        if len(grams) < 2:
+            return
+        needed = math.ceil(len(grams) / 2)
+        postings = sorted((self._postings.get(gram, [])[:MAX_POSTINGS] for gram in grams), key=len)
+        # A name sharing `needed` grams is in one of the rarest len - needed + 1 lists
+        split = len(grams) - needed + 1
+        shared = Counter()
+        for posting in postings[:split]:
+            shared.update(posting)
+        candidates = set(shared)
+        for posting in postings[split:]:
+            shared.update(candidates.intersection(posting))
+        # Rank by shared grams, breaking ties within a bounded run by length
+        ranked = sorted(shared.items(), key=itemgetter(1), reverse=True)
+        taken = 0
+        for entry_id, count in ranked:
+            if count < needed or taken >= limit * SCAN_FACTOR:
+                break
+            if entry_id not in scored:
+                normalized = self._names[entry_id][1]
+                scored[entry_id] = (3, -count, len(normalized), normalized)
+                taken += 1
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._names is not None and now - self._version_checked_at < self.version_interval:
+            return
+        version = CacheVersion.get_version(self.name)
+        with self._lock:
+            self._version_checked_at = now
+            # Our own writes bump the version too, but are already applied
+            if self._names is not None and version == self._version + self._local_writes:
+                self._version = version
+                self._local_writes = 0
+                return
+        # Nobody waits on another thread's query, which would stall an ASGI event loop: one
+        # caller builds while the others keep serving the stale index, or no suggestions
+        # before the first build lands
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            # Another caller may have built this version since we checked
+            if self._names is not None and self._version >= version:
+                return
+            names, keys, postings = self._build(db.session.execute(self.query(), bind_arguments=on_primary()))
+            with self._lock:
+                self._names, self._postings = names, postings
+                self._keys, self._key_ids = keys
+                self._version = version
+                self._local_writes = 0
+        finally:
+            self._build_lock.release()
+
+    @staticmethod
+    def _build(rows):
+        names, keys, grams = {}, [], {}
+        for entry_id, name in rows:
+            normalized = normalize(name)
+            names[entry_id] = (name, normalized)
+            keys.extend((key, entry_id) for key in _word_suffixes(normalized))
+            for gram in trigrams(normalized):
+                grams.setdefault(gram, []).append(entry_id)
+        keys.sort()
+        for ids in grams.values():
+            ids.sort()
+        return names, ([key for key, _ in keys], [entry_id for _, entry_id in keys]), grams
+
+    def _add(self, entry_id, name):
+        normalized = normalize(name)
+        self._names[entry_id] = (name, normalized)
+        for key in _word_suffixes(normalized):
+            position = bisect.bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._key_ids.insert(position, entry_id)
+        for gram in trigrams(normalized):
+            posting = self._postings.setdefault(gram, [])
+            bisect.insort(posting, entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._names.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in _word_suffixes(entry[1]):
+            position = bisect.bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._key_ids[position] == entry_id:
+                    del self._keys[position]
+                    del self._key_ids[position]
+                    break
+                position += 1
+        for gram in trigrams(entry[1]):
+            posting = self._postings.get(gram)
+            if posting is None:
+                continue
+            position = bisect.bisect_left(posting, entry_id)
+            if position < len(posting) and posting[position] == entry_id:
+                del posting[position]
+            if not posting:
+                del self._postings[gram]
+
+
+def _word_suffixes(normalized):
+    """The name from each word onwards, so a prefix query matches any word start"""
+    words = normalized.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
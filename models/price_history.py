@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, insert, select
+from .base import db, greatest, least, upsert
+
+BUCKETS = {
+    'hour': lambda at: at.replace(minute=0, second=0, microsecond=0),
+    'day': lambda at: at.replace(hour=0, minute=0, second=0, microsecond=0)
+}
+
+class PriceHistory(db.Model):
+    """Append-only log of inventory price and count changes"""
+    __tablename__ = 'price_history'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    farm_id = db.Column(db.Integer, nullable=False)
+    variety_id = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_price_history_listing_time', 'farm_id', 'variety_id', 'recorded_at'),
+    )
+
+    @classmethod
+    def record(cls, entries, at=None):
+        """Append (farm_id, variety_id, price, count) states and fold them into the rollups
+
+        Runs within the current transaction; entries are in the order the
+        changes happened, so the last one per listing is its latest state.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        at = at or datetime.utcnow()
+        db.session.execute(insert(cls.__table__), [
+            {'farm_id': farm_id, 'variety_id': variety_id, 'price': price, 'count': count, 'recorded_at': at}
+            for farm_id, variety_id, price, count in entries
+        ])
+        PriceRollup.record(entries, at)
+
+
+class PriceRollup(db.Model):
+    """Hourly and daily min, max and last price per listing, kept current by PriceHistory.record"""
+    __tablename__ = 'price_rollups'
+
+    # The key order makes a listing's buckets one contiguous range in time order
+    farm_id = db.Column(db.Integer, primary_key=True)
+    variety_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    min_price = db.Column(db.Float, nullable=False)
+    max_price = db.Column(db.Float, nullable=False)
+    last_price = db.Column(db.Float, nullable=False)
+    last_count = db.Column(db.Integer, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'start': self.bucket_start.isoformat(),
+            'min_price': self.min_price,
+            'max_price': self.max_price,
+            'last_price': self.last_price,
+            'last_count': self.last_count,
+            'samples': self.samples
+        }
+
+    @classmethod
+    def record(cls, entries, at):
+        """Fold (farm_id, variety_id, price, count) states observed at `at` into every bucket"""
+        rows = {}
+        for farm_id, variety_id, price, count in entries:
+            for bucket, start_of in BUCKETS.items():
+                key = (farm_id, variety_id, bucket)
+                row = rows.get(key)
+                if row is None:
+                    rows[key] = {
+                        'farm_id': farm_id, 'variety_id': variety_id, 'bucket': bucket,
+                        'bucket_start': start_of(at), 'min_price': price, 'max_price': price,
+                        'last_price': price, 'last_count': count, 'last_at': at, 'samples': 1
+                    }
+                else:
+                    row.update(min_price=min(row['min_price'], price), max_price=max(row['max_price'], price),
+                               last_price=price, last_count=count, samples=row['samples'] + 1)
+
+        table = cls.__table__
+
+        def set_(incoming):
+            # A concurrent writer may commit an older observation after ours
+            newer = incoming.last_at >= table.c.last_at
+            return {
+                'min_price': least(table.c.min_price, incoming.min_price),
+                'max_price': greatest(table.c.max_price, incoming.max_price),
+                'last_price': case((newer, incoming.last_price), else_=table.c.last_price),
+                'last_count': case((newer, incoming.last_count), else_=table.c.last_count),
+                'last_at': greatest(table.c.last_at, incoming.last_at),
+                'samples': table.c.samples + incoming.samples
+            }
+
+        db.session.execute(upsert(table, ['farm_id', 'variety_id', 'bucket', 'bucket_start'], set_), list(rows.values()))
+
+    @classmethod
+    def series(cls, farm_id, variety_id, bucket, start, end):
+        """Get a listing's buckets starting in [start, end), oldest first"""
+        return db.session.scalars(
+            select(cls).where(
+                cls.farm_id == farm_id,
+                cls.variety_id == variety_id,
+                cls.bucket == bucket,
+                cls.bucket_start >= BUCKETS[bucket](start),
+                cls.bucket_start < end
+            ).order_by(cls.bucket_start)
+        ).all()
+
+    @staticmethod
+    def default_range(bucket, end=None):
+        """The window served when no range is given: a week of hours or a year of days"""
+        end = end or datetime.utcnow()
+        return end - (timedelta(days=7) if bucket == 'hour' else timedelta(days=365)), end
@@ -1,5 +1,7 @@
 from datetime import datetime
-from .base import db
+from sqlalchemy import case, or_, select
+from sqlalchemy.exc import IntegrityError
+from .base import db, upsert
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -39,11 +41,65 @@ class User(db.Model):
         db.session.commit()
         return user
 
+    @classmethod
+    def upsert_user(cls, firebase_id, **fields):
+        """Create the user or update the given fields in a single statement and commit
+
+        updated_at only moves when a value actually differs. Returns
+        (user, created) with user detached from the session; raises
+        IntegrityError if the email belongs to another user.
+        """
+        dialect = db.session.get_bind().dialect
+        # MySQL rounds DATETIME to whole seconds, so compare at that precision there
+        now = datetime.utcnow()
+        if not dialect.insert_returning:
+            now = now.replace(microsecond=0)
+
+        def set_(incoming):
+            changed = or_(*(getattr(cls, key).is_distinct_from(getattr(incoming, key)) for key in fields))
+            return dict(
+                {key: getattr(incoming, key) for key in fields},
+                updated_at=case((changed, now), else_=cls.updated_at)
+            )
+
+        stmt = upsert(cls, ['firebase_id'], set_).values(
+            firebase_id=firebase_id, created_at=now, updated_at=now, **fields)
+        options = {'populate_existing': True}
+        try:
+            if dialect.insert_returning:
+                user = db.session.scalars(stmt.returning(cls), execution_options=options).one()
+            else:
+                db.session.execute(stmt)
+                user = db.session.scalars(select(cls).where(cls.firebase_id == firebase_id),
+                                          execution_options=options).one()
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        # Detach so the commit does not expire what the statement just returned
+        db.session.expunge(user)
+        db.session.commit()
+        # Our timestamp only lands in created_at when this statement inserted the row
+        return user, user.created_at == now
+
     @classmethod
     def get_by_firebase_id(cls, firebase_id):
         """Get user by Firebase ID"""
         return cls.query.filter_by(firebase_id=firebase_id).first()
 
+    @classmethod
+    def get_by_firebase_ids(cls, firebase_ids):
+        """Get a dict of Firebase ID to user for the users that exist"""
+        users = db.session.scalars(select(cls).where(cls.firebase_id.in_(set(firebase_ids))))
+        return {user.firebase_id: user for user in users}
+
+    @classmethod
+    def get_version(cls, firebase_id):
+        """Get the values that change whenever the user's to_dict() does, or None"""
+        row = db.session.execute(
+            select(cls.id, cls.updated_at).where(cls.firebase_id == firebase_id)
+        ).first()
+        return tuple(row) if row else None
+
     @classmethod
     def get_by_email(cls, email):
         """Get user by email"""
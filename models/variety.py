@@ -1,8 +1,17 @@
 from datetime import datetime
-from .base import db
+from sqlalchemy import and_, delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from .base import db, farm_variety, on_primary
+from .archive import archive_rows, archived_farm_varieties, archived_inventory, archived_varieties, restore_rows
+from .cache import variety_cache
+from .name_index import NameIndex
+from .change_event import stage_change
 
 class Variety(db.Model):
     __tablename__ = 'varieties'
+    # Archived varieties keep their IDs, so SQLite must not hand them out again
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -20,41 +29,192 @@ class Variety(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+    def _cache(self, generation):
+        """Store this variety's column values and serialized form in the catalog cache
+
+        generation is variety_cache.generation() from before the row was read.
+        """
+        values = {column.key: getattr(self, column.key) for column in self.__table__.columns}
+        return variety_cache.put(self.id, self.name, (values, self.to_dict()), generation)
+
+    @classmethod
+    def _from_cache(cls, values):
+        """Attach a cached variety to the session without querying"""
+        variety = cls(**values)
+        make_transient_to_detached(variety)
+        return db.session.merge(variety, load=False)
+
+    @classmethod
+    def _fill_cache(cls, where):
+        """Load the varieties matching where from the primary and cache them as (variety, entry) pairs
+
+        A replica's lag would outlive the request in the cache, and replica
+        copies already in the session are overwritten rather than cached.
+        """
+        generation = variety_cache.generation()
+        stmt = select(cls).where(where).execution_options(populate_existing=True)
+        return [(variety, variety._cache(generation))
+                for variety in db.session.scalars(stmt, bind_arguments=on_primary())]
+
+    @classmethod
+    def prime_cache(cls, variety_ids):
+        """Load every uncached variety among variety_ids with a single query"""
+        missing = {variety_id for variety_id in variety_ids if variety_cache.get(variety_id) is None}
+        if missing:
+            cls._fill_cache(cls.id.in_(missing))
+
+    @classmethod
+    def get_cached_dict(cls, variety_id):
+        """Get a variety's to_dict() through the catalog cache"""
+        entry = variety_cache.get(variety_id)
+        if entry is None:
+            filled = cls._fill_cache(cls.id == variety_id)
+            if not filled:
+                return None
+            entry = filled[0][1]
+        return dict(entry[1])
+
+    @classmethod
+    def get_cached_dicts(cls, variety_ids):
+        """Get a dict of variety ID to to_dict() for the varieties that exist"""
+        found = {}
+        missing = set()
+        for variety_id in set(variety_ids):
+            entry = variety_cache.get(variety_id)
+            if entry is None:
+                missing.add(variety_id)
+            else:
+                found[variety_id] = dict(entry[1])
+        if missing:
+            for variety, entry in cls._fill_cache(cls.id.in_(missing)):
+                found[variety.id] = dict(entry[1])
+        return found
+
     @classmethod
     def create_variety(cls, name):
         """Create a new variety"""
         variety = cls(name=name)
         db.session.add(variety)
+        variety_cache.bump()
         db.session.commit()
+        variety_names.add(variety.id, variety.name)
         return variety
 
     @classmethod
     def get_by_id(cls, variety_id):
         """Get variety by ID"""
-        return cls.query.get(variety_id)
+        entry = variety_cache.get(variety_id)
+        if entry is not None:
+            return cls._from_cache(entry[0])
+        filled = cls._fill_cache(cls.id == variety_id)
+        return filled[0][0] if filled else None
+
+    @classmethod
+    def get_version(cls, variety_id):
+        """Get the values that change whenever the variety's to_dict() does, or None"""
+        variety = cls.get_by_id(variety_id)
+        return (variety.id, variety.updated_at) if variety else None
 
     @classmethod
     def get_by_name(cls, name):
         """Get variety by name"""
-        return cls.query.filter_by(name=name).first()
+        variety_id = variety_cache.get_id(name)
+        if variety_id is not None:
+            return cls.get_by_id(variety_id)
+        filled = cls._fill_cache(cls.name == name)
+        return filled[0][0] if filled else None
+
+    @classmethod
+    def suggest(cls, text, limit=10):
+        """Get up to limit {'id', 'name'} dicts of varieties matching typed text, best first"""
+        return [{'id': variety_id, 'name': name} for variety_id, name in variety_names.suggest(text, limit)]
 
     @classmethod
     def update_variety(cls, variety_id, **kwargs):
         """Update variety fields"""
-        variety = cls.get_by_id(variety_id)
+        variety = cls.query.get(variety_id)
         if variety:
             for key, value in kwargs.items():
                 if hasattr(variety, key):
                     setattr(variety, key, value)
+            variety_cache.bump()
             db.session.commit()
+            variety_cache.invalidate(variety_id)
+            variety_names.add(variety.id, variety.name)
         return variety
 
     @classmethod
-    def delete_variety(cls, variety_id):
-        """Delete variety by ID"""
-        variety = cls.get_by_id(variety_id)
-        if variety:
-            db.session.delete(variety)
+    def delete_variety(cls, variety_id, archive=False):
+        """Delete a variety with its inventory, farm links and stats in a few set-based statements
+
+        As with Farm.delete_farm nothing is loaded into Python; with archive
+        the rows are first copied into the archive tables for restore_variety,
+        raising IntegrityError if an archived copy already holds one of their keys.
+        """
+        from .farm import Farm
+        from .inventory import Inventory
+        from .variety_stats import VarietyStats
+
+        if db.session.execute(select(cls.id).where(cls.id == variety_id).with_for_update()).first() is None:
+            return False
+        listings = Inventory.variety_id == variety_id
+        links = farm_variety.c.variety_id == variety_id
+        try:
+            Farm.touch(select(Inventory.farm_id).where(listings).union(select(farm_variety.c.farm_id).where(links)))
+            if archive:
+                now = datetime.utcnow()
+                archive_rows(archived_inventory, Inventory.__table__, listings, now)
+                archive_rows(archived_farm_varieties, farm_variety, links, now)
+                archive_rows(archived_varieties, cls.__table__, cls.id == variety_id, now)
+            db.session.execute(delete(Inventory.__table__).where(listings))
+            db.session.execute(delete(farm_variety).where(links))
+            db.session.execute(delete(VarietyStats.__table__).where(VarietyStats.variety_id == variety_id))
+            db.session.execute(delete(cls.__table__).where(cls.id == variety_id))
+            # Touches listings of any number of farms, so it goes to every subscriber
+            stage_change('variety', None, {'variety_id': variety_id, 'action': 'archived' if archive else 'deleted'})
+            variety_cache.bump()
             db.session.commit()
-            return True
-        return False 
\ No newline at end of file
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        variety_cache.invalidate(variety_id)
+        variety_names.remove(variety_id)
+        return True
+
+    @classmethod
+    def restore_variety(cls, variety_id):
+        """Put an archived variety back with its inventory and farm links, or return None
+
+        Archived rows for farms deleted since stay archived until the farm is
+        restored too. Raises IntegrityError if the variety's ID or name was
+        taken meanwhile.
+        """
+        from .farm import Farm
+        from .inventory import Inventory
+        from .variety_stats import VarietyStats
+
+        try:
+            if not restore_rows(archived_varieties, cls.__table__, archived_varieties.c.id == variety_id):
+                return None
+            restore_rows(archived_inventory, Inventory.__table__, and_(
+                archived_inventory.c.variety_id == variety_id,
+                select(Farm.id).where(Farm.id == archived_inventory.c.farm_id).exists()
+            ))
+            restore_rows(archived_farm_varieties, farm_variety, and_(
+                archived_farm_varieties.c.variety_id == variety_id,
+                select(Farm.id).where(Farm.id == archived_farm_varieties.c.farm_id).exists()
+            ))
+            VarietyStats.add_listings(Inventory.variety_id == variety_id)
+            Farm.touch(select(Inventory.farm_id).where(Inventory.variety_id == variety_id)
+                       .union(select(farm_variety.c.farm_id).where(farm_variety.c.variety_id == variety_id)))
+            stage_change('variety', None, {'variety_id': variety_id, 'action': 'restored'})
+            variety_cache.bump()
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        variety = cls.get_by_id(variety_id)
+        variety_names.add(variety.id, variety.name)
+        return variety
+
+variety_names = NameIndex(variety_cache.name, lambda: select(Variety.id, Variety.name))
@@ -0,0 +1,229 @@
+from datetime import datetime
+from sqlalchemy import and_, bindparam, delete, func, insert, literal, not_, select, update
+from .base import db, greatest, least, upsert
+
+class VarietyStats(db.Model):
+    """Market aggregates per variety, maintained incrementally by inventory writes"""
+    __tablename__ = 'variety_stats'
+
+    variety_id = db.Column(db.Integer, db.ForeignKey('varieties.id', ondelete='CASCADE'), primary_key=True)
+    farm_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Float, nullable=False, default=0)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'variety_id': self.variety_id,
+            'farm_count': self.farm_count,
+            'total_count': self.total_count,
+            'min_price': self.min_price,
+            'avg_price': self.price_sum / self.farm_count if self.farm_count else None,
+            'max_price': self.max_price,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    @staticmethod
+    def empty_dict(variety_id):
+        """Stats for a variety nobody lists"""
+        return {
+            'variety_id': variety_id,
+            'farm_count': 0,
+            'total_count': 0,
+            'min_price': None,
+            'avg_price': None,
+            'max_price': None,
+            'updated_at': None
+        }
+
+    @classmethod
+    def record_changes(cls, changes):
+        """Fold inventory row changes into the aggregates within the current transaction
+
+        changes is an iterable of (variety_id, old, new) where old and new are
+        (price, count) tuples, or None for an inserted or deleted row. Must run
+        after the inventory rows themselves were written.
+        """
+        deltas = {}
+        for variety_id, old, new in changes:
+            delta = deltas.setdefault(variety_id, {
+                'variety_id': variety_id, 'farm_count': 0, 'total_count': 0, 'price_sum': 0.0,
+                'min_price': None, 'max_price': None, 'removed_min': None, 'removed_max': None
+            })
+            old_price, old_count = old if old is not None else (None, 0)
+            new_price, new_count = new if new is not None else (None, 0)
+            delta['farm_count'] += (new is not None) - (old is not None)
+            delta['total_count'] += new_count - old_count
+            delta['price_sum'] += (new_price or 0) - (old_price or 0)
+            if new_price is not None and new_price != old_price:
+                delta['min_price'] = min(new_price, delta['min_price'] if delta['min_price'] is not None else new_price)
+                delta['max_price'] = max(new_price, delta['max_price'] if delta['max_price'] is not None else new_price)
+            if old_price is not None and new_price != old_price:
+                delta['removed_min'] = min(old_price, delta['removed_min'] if delta['removed_min'] is not None else old_price)
+                delta['removed_max'] = max(old_price, delta['removed_max'] if delta['removed_max'] is not None else old_price)
+        if not deltas:
+            return
+
+        table = cls.__table__
+        now = datetime.utcnow()
+        stmt = upsert(table, ['variety_id'], lambda incoming: {
+            'farm_count': table.c.farm_count + incoming.farm_count,
+            'total_count': table.c.total_count + incoming.total_count,
+            'price_sum': table.c.price_sum + incoming.price_sum,
+            'min_price': least(func.coalesce(table.c.min_price, incoming.min_price),
+                               func.coalesce(incoming.min_price, table.c.min_price)),
+            'max_price': greatest(func.coalesce(table.c.max_price, incoming.max_price),
+                                  func.coalesce(incoming.max_price, table.c.max_price)),
+            'updated_at': now
+        })
+        db.session.execute(stmt, [
+            {key: delta[key] for key in ('variety_id', 'farm_count', 'total_count', 'price_sum', 'min_price', 'max_price')}
+            | {'updated_at': now}
+            for delta in deltas.values()
+        ])
+
+        # A price that left may have been the extreme; re-read it through ix_inventory_variety_price
+        removed = [delta for delta in deltas.values() if delta['removed_min'] is not None]
+        if removed:
+            cls._recompute_extremes(removed)
+
+    @classmethod
+    def record_stock_changes(cls, count_changes):
+        """Fold (variety_id, count_change) pairs into the total stock"""
+        totals = {}
+        for variety_id, count_change in count_changes:
+            totals[variety_id] = totals.get(variety_id, 0) + count_change
+        totals = {variety_id: change for variety_id, change in totals.items() if change}
+        if totals:
+            db.session.execute(
+                update(cls.__table__)
+                .where(cls.__table__.c.variety_id == bindparam('b_variety_id'))
+                .values(total_count=cls.__table__.c.total_count + bindparam('b_change'), updated_at=datetime.utcnow()),
+                [{'b_variety_id': variety_id, 'b_change': change} for variety_id, change in totals.items()]
+            )
+
+    @classmethod
+    def remove_listings(cls, listings):
+        """Take the inventory rows matching the listings clause out of the aggregates
+
+        Runs as one UPDATE over the affected varieties, before those rows are
+        deleted, however many there are.
+        """
+        from .inventory import Inventory
+
+        table = cls.__table__
+        leaving = and_(Inventory.variety_id == table.c.variety_id, listings)
+        staying = and_(Inventory.variety_id == table.c.variety_id, not_(listings))
+
+        def total(value):
+            return select(func.coalesce(func.sum(value), 0)).where(leaving).scalar_subquery()
+
+        db.session.execute(
+            update(table)
+            .where(table.c.variety_id.in_(select(Inventory.variety_id).where(listings)))
+            .values(
+                farm_count=table.c.farm_count - select(func.count(Inventory.id)).where(leaving).scalar_subquery(),
+                total_count=table.c.total_count - total(Inventory.count),
+                price_sum=table.c.price_sum - total(Inventory.price),
+                min_price=select(func.min(Inventory.price)).where(staying).scalar_subquery(),
+                max_price=select(func.max(Inventory.price)).where(staying).scalar_subquery(),
+                updated_at=datetime.utcnow()
+            ),
+            execution_options={'synchronize_session': False}
+        )
+
+    @classmethod
+    def add_listings(cls, listings):
+        """Fold the inventory rows matching the listings clause into the aggregates, after they were inserted"""
+        table = cls.__table__
+        now = datetime.utcnow()
+        stmt = upsert(table, ['variety_id'], lambda incoming: {
+            'farm_count': table.c.farm_count + incoming.farm_count,
+            'total_count': table.c.total_count + incoming.total_count,
+            'price_sum': table.c.price_sum + incoming.price_sum,
+            'min_price': least(func.coalesce(table.c.min_price, incoming.min_price),
+                               func.coalesce(incoming.min_price, table.c.min_price)),
+            'max_price': greatest(func.coalesce(table.c.max_price, incoming.max_price),
+                                  func.coalesce(incoming.max_price, table.c.max_price)),
+            'updated_at': now
+        })
+        db.session.execute(stmt.from_select(
+            ['variety_id', 'farm_count', 'total_count', 'price_sum', 'min_price', 'max_price', 'updated_at'],
+            cls.live_query().where(listings).add_columns(literal(now))
+        ))
+
+    @classmethod
+    def _recompute_extremes(cls, removed):
+        from .inventory import Inventory
+
+        table = cls.__table__
+        listed = Inventory.variety_id == table.c.variety_id
+        db.session.execute(
+            update(table)
+            .where(table.c.variety_id == bindparam('b_variety_id'))
+            .where((table.c.min_price >= bindparam('b_removed_min')) | (table.c.max_price <= bindparam('b_removed_max')))
+            .values(
+                min_price=select(func.min(Inventory.price)).where(listed).scalar_subquery(),
+                max_price=select(func.max(Inventory.price)).where(listed).scalar_subquery()
+            ),
+            [
+                {'b_variety_id': delta['variety_id'], 'b_removed_min': delta['removed_min'], 'b_removed_max': delta['removed_max']}
+                for delta in removed
+            ]
+        )
+
+    @classmethod
+    def live_query(cls):
+        """Aggregate the inventory table into rows shaped like variety_stats"""
+        from .inventory import Inventory
+
+        return select(
+            Inventory.variety_id,
+            func.count().label('farm_count'),
+            func.coalesce(func.sum(Inventory.count), 0).label('total_count'),
+            func.coalesce(func.sum(Inventory.price), 0).label('price_sum'),
+            func.min(Inventory.price).label('min_price'),
+            func.max(Inventory.price).label('max_price')
+        ).group_by(Inventory.variety_id)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every row from the inventory table and commit"""
+        live = cls.live_query().subquery()
+        db.session.execute(delete(cls.__table__))
+        db.session.execute(insert(cls.__table__).from_select(
+            ['variety_id', 'farm_count', 'total_count', 'price_sum', 'min_price', 'max_price', 'updated_at'],
+            select(live, literal(datetime.utcnow()))
+        ))
+        db.session.commit()
+
+    @classmethod
+    def verify(cls, tolerance=1e-6):
+        """Compare the maintained rows with a fresh aggregate; return a list of mismatches"""
+        live = {row.variety_id: row for row in db.session.execute(cls.live_query())}
+        stored = {row.variety_id: row for row in cls.query}
+        mismatches = []
+        for variety_id in sorted(set(live) | set(stored)):
+            expected, actual = live.get(variety_id), stored.get(variety_id)
+            if expected is None and actual is not None and actual.farm_count == 0:
+                continue  # Nothing listed any more; an empty row is still correct
+            for field in ('farm_count', 'total_count', 'price_sum', 'min_price', 'max_price'):
+                want = getattr(expected, field) if expected is not None else None
+                have = getattr(actual, field) if actual is not None else None
+                if not _close(want, have, tolerance):
+                    mismatches.append({'variety_id': variety_id, 'field': field, 'expected': want, 'actual': have})
+        return mismatches
+
+    @classmethod
+    def get_for_variety(cls, variety_id):
+        """Get the stats dict for one variety"""
+        stats = db.session.get(cls, variety_id)
+        return stats.to_dict() if stats else cls.empty_dict(variety_id)
+
+
+def _close(want, have, tolerance):
+    if want is None or have is None:
+        return want == have
+    return abs(want - have) <= tolerance * max(1.0, abs(want))
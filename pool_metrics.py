@@ -0,0 +1,109 @@
+import threading
+import time
+from flask import current_app, jsonify
+from sqlalchemy import event, exc
+
+
+class PoolMetrics:
+    """Counters for one engine's connection pool, fed by SQLAlchemy pool events"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_timeouts = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.overflow_max = 0
+
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+        event.listen(engine, 'soft_invalidate', self._on_soft_invalidate)
+        event.listen(engine, 'engine_disposed', lambda engine: self._time_checkouts(engine.pool))
+        self._time_checkouts(engine.pool)
+
+    def _time_checkouts(self, pool):
+        # The pool has no "checkout requested" event, so time Pool.connect itself
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            except exc.TimeoutError:
+                with self._lock:
+                    self.checkout_timeouts += 1
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self.checkout_wait_total += waited
+                    self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+        pool.connect = timed_connect
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        overflow = self._pool_stat('overflow')
+        with self._lock:
+            self.checkouts += 1
+            if overflow is not None:
+                self.overflow_max = max(self.overflow_max, overflow)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _on_soft_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.soft_invalidations += 1
+
+    def _pool_stat(self, name):
+        # Only QueuePool reports size and overflow
+        stat = getattr(self.engine.pool, name, None)
+        return stat() if callable(stat) else None
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'pool_class': type(self.engine.pool).__name__,
+                'size': self._pool_stat('size'),
+                'checked_out': self._pool_stat('checkedout'),
+                'overflow': self._pool_stat('overflow'),
+                'overflow_max': self.overflow_max,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_wait_total_ms': round(self.checkout_wait_total * 1000, 3),
+                'checkout_wait_avg_ms': round(self.checkout_wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0,
+                'checkout_wait_max_ms': round(self.checkout_wait_max * 1000, 3),
+                'invalidations': self.invalidations,
+                'soft_invalidations': self.soft_invalidations
+            }
+
+
+def init_app(app, db):
+    """Instrument every engine of the app and expose the counters at /metrics/pool"""
+    with app.app_context():
+        metrics = {bind or 'default': PoolMetrics(engine) for bind, engine in db.engines.items()}
+    app.extensions['pool_metrics'] = metrics
+    app.add_url_rule('/metrics/pool', 'pool_metrics', pool_metrics_view)
+
+
+def pool_metrics_view():
+    metrics = current_app.extensions['pool_metrics']
+    return jsonify({bind: pool.to_dict() for bind, pool in metrics.items()})
@@ -0,0 +1,112 @@
+import json
+import re
+import threading
+import time
+from collections import deque
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+_PLACEHOLDER_LIST = re.compile(r'\((\s*(\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(\?|%\(\w+\)s|%s|:\w+)\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize a SQL statement so repeats differing only in parameters compare equal"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _PLACEHOLDER_LIST.sub('(?, ...)', shape)
+    return _NUMBER.sub('N', shape)
+
+
+class SQLProfiler:
+    """Records the SQL issued by each request and flags likely N+1 patterns"""
+
+    def __init__(self, app, db):
+        self.nplus1_threshold = app.config['SQL_PROFILING_NPLUS1_THRESHOLD']
+        self.history = deque(maxlen=app.config['SQL_PROFILING_HISTORY'])
+        self._lock = threading.Lock()
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Per statement, so one that fails leaves nothing behind on the connection
+        context.profiling_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'sql_queries' in g:
+            g.sql_queries.append((statement, time.perf_counter() - context.profiling_started))
+
+    def _start_request(self):
+        g.sql_queries = []
+        g.sql_request_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        if 'sql_queries' not in g:
+            return response
+        queries, started = g.sql_queries, g.sql_request_started
+        details = {'method': request.method, 'path': request.full_path.rstrip('?'), 'status': response.status_code}
+        logger = current_app.logger
+        if response.is_streamed:
+            # A streamed body runs its queries while it is sent, after the headers are gone
+            response.call_on_close(lambda: self._record(queries, started, details, logger))
+            return response
+
+        summary = self._record(queries, started, details, logger)
+        response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (summary['db_ms'], summary['queries']))
+        response.headers.add('Server-Timing', 'app;dur=%.2f' % summary['total_ms'])
+        return response
+
+    def _record(self, queries, started, details, logger):
+        summary = self.summarize(queries, time.perf_counter() - started)
+        summary.update(details)
+        logger.info('sql_profile %s', json.dumps({
+            key: summary[key] for key in ('method', 'path', 'status', 'queries', 'db_ms', 'total_ms', 'nplus1')
+        }))
+        with self._lock:
+            self.history.append(summary)
+        return summary
+
+    def summarize(self, queries, elapsed):
+        """Aggregate (statement, seconds) pairs into per-shape counts and timings"""
+        shapes = {}
+        for statement, duration in queries:
+            shape = shapes.setdefault(statement_shape(statement), {'count': 0, 'ms': 0.0})
+            shape['count'] += 1
+            shape['ms'] += duration * 1000
+        breakdown = sorted(
+            ({'statement': statement, 'count': stats['count'], 'ms': round(stats['ms'], 3)}
+             for statement, stats in shapes.items()),
+            key=lambda shape: shape['ms'], reverse=True
+        )
+        return {
+            'queries': len(queries),
+            'db_ms': round(sum(duration for _, duration in queries) * 1000, 3),
+            'total_ms': round(elapsed * 1000, 3),
+            'nplus1': [shape['statement'] for shape in breakdown if shape['count'] >= self.nplus1_threshold],
+            'breakdown': breakdown
+        }
+
+    def slowest(self, limit=20):
+        """Get the slowest recorded requests, slowest first"""
+        with self._lock:
+            recent = list(self.history)
+        return sorted(recent, key=lambda summary: summary['total_ms'], reverse=True)[:limit]
+
+
+def init_app(app, db):
+    """Enable per-request SQL profiling when SQL_PROFILING is set"""
+    if not app.config['SQL_PROFILING']:
+        return
+    app.extensions['sql_profiler'] = SQLProfiler(app, db)
+    if app.debug:
+        app.add_url_rule('/debug/sql', 'debug_sql', debug_sql_view)
+
+
+def debug_sql_view():
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(current_app.extensions['sql_profiler'].slowest(limit))
@@ -0,0 +1,103 @@
+import math
+import random
+import threading
+import time
+from flask import current_app, jsonify, request
+from config import replica_binds
+from models import db
+
+HEADER = 'X-Read-Primary-Until'
+COOKIE = 'read_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def read_primary(view):
+    """Keep a GET view on the primary, for reads that must not lag behind it"""
+    view.read_primary = True
+    return view
+
+
+class ReplicaRouter:
+    """Chooses where each request reads from and counts the choices
+
+    GET and HEAD requests read from a random replica unless the client
+    carries an unexpired read-your-writes token; a write request that
+    succeeds hands out a token good for sticky_seconds.
+    """
+
+    def __init__(self, bind_keys, sticky_seconds=5):
+        self.bind_keys = bind_keys
+        self.sticky_seconds = sticky_seconds
+        self._lock = threading.Lock()
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.sticky_reads = 0
+
+    def choose(self):
+        """Get the bind key the current request should read from, or None for the primary"""
+        view = current_app.view_functions.get(request.endpoint)
+        if request.method not in READ_METHODS or getattr(view, 'read_primary', False):
+            bind_key, counter = None, 'primary_reads'
+        elif self.sticky_until() is not None:
+            bind_key, counter = None, 'sticky_reads'
+        else:
+            bind_key, counter = random.choice(self.bind_keys), 'replica_reads'
+        if request.method in READ_METHODS:
+            with self._lock:
+                setattr(self, counter, getattr(self, counter) + 1)
+        return bind_key
+
+    def sticky_until(self):
+        """The client's read-your-writes deadline while it lasts, else None"""
+        value = request.headers.get(HEADER) or request.cookies.get(COOKIE)
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            return None
+        now = time.time()
+        # A deadline further out than one window was not handed out here
+        if now < until <= now + self.sticky_seconds:
+            return until
+        return None
+
+    def issue_token(self, response):
+        until = '%.3f' % (time.time() + self.sticky_seconds)
+        response.headers[HEADER] = until
+        response.set_cookie(COOKIE, until, max_age=math.ceil(self.sticky_seconds), httponly=True, samesite='Lax')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'replicas': len(self.bind_keys),
+                'replica_reads': self.replica_reads,
+                'primary_reads': self.primary_reads,
+                'sticky_reads': self.sticky_reads
+            }
+
+
+def _route_request():
+    db.session.info['replica'] = current_app.extensions['replicas'].choose()
+
+
+def _after_request(response):
+    if request.method not in READ_METHODS and request.method != 'OPTIONS' and response.status_code < 400:
+        current_app.extensions['replicas'].issue_token(response)
+    return response
+
+
+def init_app(app):
+    """Route GET reads to DATABASE_REPLICA_URLS when set; counters at /metrics/replicas
+
+    Call after db.init_app, with replica_binds merged into SQLALCHEMY_BINDS.
+    """
+    bind_keys = sorted(replica_binds(app.config))
+    if not bind_keys:
+        return
+    app.extensions['replicas'] = ReplicaRouter(bind_keys, app.config['REPLICA_STICKY_SECONDS'])
+    app.before_request(_route_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics/replicas', 'replica_metrics', replica_metrics_view)
+
+
+def replica_metrics_view():
+    return jsonify(current_app.extensions['replicas'].to_dict())
@@ -0,0 +1,33 @@
+from flask import jsonify
+
+MAX_BATCH_SIZE = 100
+
+
+def batch_ids(raw, convert=int):
+    """Split a comma-separated ?ids= value, raising ValueError on bad input"""
+    try:
+        keys = [convert(part) for part in raw.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError('Invalid ids')
+    return check_batch(keys)
+
+
+def check_batch(keys):
+    """Reject empty or oversized batches, raising ValueError"""
+    if not keys:
+        raise ValueError('No ids given')
+    if len(keys) > MAX_BATCH_SIZE:
+        raise ValueError('At most %d ids per request' % MAX_BATCH_SIZE)
+    return keys
+
+
+def batch_response(keys, found):
+    """Answer {"items": [...], "not_found": [...]} with items in request order
+
+    found maps each key that exists to its serialized dict; missing keys get
+    a null placeholder so items[i] always answers keys[i].
+    """
+    return jsonify({
+        'items': [found.get(key) for key in keys],
+        'not_found': [key for key in dict.fromkeys(keys) if key not in found]
+    })
@@ -0,0 +1,44 @@
+import hashlib
+from datetime import datetime, timezone
+from flask import Response, current_app, jsonify, request
+
+
+def conditional_json(version, build, not_found='Not found'):
+    """Answer a GET with 304 when the client already holds this version
+
+    version is a tuple of cheap-to-read values that changes whenever the
+    serialized body would; build is only called when a body must be sent,
+    and may return None if the record vanished meanwhile, giving a 404.
+    With single-flight on, concurrent requests for the same path and
+    version share one build and its serialized body.
+    """
+    etag = hashlib.sha1(repr(version).encode()).hexdigest()
+    timestamps = [value for value in version if isinstance(value, datetime)]
+    last_modified = max(timestamps).replace(tzinfo=timezone.utc, microsecond=0) if timestamps else None
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        if 'single_flight' in current_app.extensions:
+            body = current_app.extensions['single_flight'].do((request.path, etag), lambda: _serialize(build()))
+        else:
+            body = _serialize(build())
+        if body is None:
+            return jsonify({'error': not_found}), 404
+        response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def _serialize(value):
+    # Matches jsonify's output
+    return None if value is None else current_app.json.dumps(value) + '\n'
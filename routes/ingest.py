@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import math
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+# Largest value the Integer id and count columns hold on every backend
+MAX_INTEGER = 2 ** 31 - 1
+
+
+def iter_rows(stream, mimetype):
+    """Yield (line, row, error) for each record of an NDJSON or CSV body as it is read"""
+    # Bad bytes become a row error instead of aborting the upload halfway
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='surrogateescape', newline='')
+    if mimetype == 'text/csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            if all(_is_utf8(value) for value in row.values() if isinstance(value, str)):
+                yield reader.line_num, row, None
+            else:
+                yield reader.line_num, None, 'Invalid UTF-8'
+        return
+
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        if not _is_utf8(raw):
+            yield line, None, 'Invalid UTF-8'
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError:
+            yield line, None, 'Invalid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield line, None, 'Expected a JSON object'
+            continue
+        yield line, row, None
+
+
+def parse_inventory_row(row):
+    """Validate a raw row into inventory values, raising ValueError on bad input"""
+    try:
+        values = {
+            'farm_id': int(row['farm_id']),
+            'variety_id': int(row['variety_id']),
+            'price': float(row['price']),
+            'count': int(row.get('count') or 0)
+        }
+    except KeyError as e:
+        raise ValueError('Missing field %s' % e.args[0])
+    except (TypeError, ValueError):
+        raise ValueError('Invalid field value')
+    if not math.isfinite(values['price']):
+        raise ValueError('Price must be a finite number')
+    if values['price'] < 0 or values['count'] < 0:
+        raise ValueError('Price and count must not be negative')
+    for key in ('farm_id', 'variety_id', 'count'):
+        if not -MAX_INTEGER <= values[key] <= MAX_INTEGER:
+            raise ValueError('%s is out of range' % key)
+    return values
+
+
+def _is_utf8(text):
+    # Undecodable bytes survive as lone surrogates, which cannot be encoded back
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
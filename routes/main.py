@@ -1,11 +1,63 @@
-from flask import Blueprint, jsonify, request
+import time
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from models.base import page_query
 from models.user import User
-from models.farm import Farm
+from models.farm import Farm, UnknownVarieties
 from models.variety import Variety
-from models.inventory import Inventory
+from models.inventory import Inventory, InsufficientStock
+from models.variety_stats import VarietyStats
+from models.price_history import BUCKETS, PriceRollup
+from routes.pagination import MAX_PAGE_SIZE, page_args
+from routes.batch import batch_ids, batch_response, check_batch
+from routes.streaming import STREAM_BATCH_SIZE, stream_page
+from routes.conditional import conditional_json
+from routes.ingest import CHUNK_SIZE, MAX_REPORTED_ERRORS, iter_rows, parse_inventory_row
+from replicas import read_primary
 
 main = Blueprint('main', __name__)
 
+MAX_SUGGESTIONS = 50
+MAX_RADIUS_KM = 500
+
+def to_dicts(rows):
+    return [row.to_dict() for row in rows]
+
+def to_dict(row):
+    return row.to_dict() if row is not None else None
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp into the naive UTC the database stores"""
+    at = datetime.fromisoformat(value)
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+def archive_requested():
+    """Whether a DELETE asked to keep the rows for a later restore (?archive=true)"""
+    return request.args.get('archive', 'false').lower() in ('1', 'true', 'yes')
+
+def parse_coordinates(latitude, longitude):
+    """Check a latitude and longitude pair and convert it to floats"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('latitude and longitude must be numbers')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('latitude must be within [-90, 90] and longitude within [-180, 180]')
+    return latitude, longitude
+
+def parse_arg(args, key, convert, default=None):
+    """Convert an optional request arg, raising ValueError when it is malformed"""
+    value = args.get(key)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError('Invalid %s' % key)
+
 # User routes
 @main.route('/users', methods=['POST'])
 def create_user():
@@ -19,63 +71,350 @@ def create_user():
     )
     return jsonify(user.to_dict()), 201
 
+@main.route('/users', methods=['GET'])
+def list_users():
+    try:
+        after_id, limit = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return stream_page(page_query(User.id, after_id, limit).yield_per(STREAM_BATCH_SIZE), to_dicts, limit)
+
+@main.route('/users/batch-get', methods=['POST'])
+def batch_get_users():
+    data = request.get_json(silent=True) or {}
+    firebase_ids = data.get('firebase_ids')
+    try:
+        if not isinstance(firebase_ids, list) or not all(isinstance(fid, str) for fid in firebase_ids):
+            raise ValueError('firebase_ids must be a list of strings')
+        check_batch(firebase_ids)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    users = User.get_by_firebase_ids(firebase_ids)
+    return batch_response(firebase_ids, {fid: user.to_dict() for fid, user in users.items()})
+
+@main.route('/users/<firebase_id>', methods=['PUT'])
+def upsert_user(firebase_id):
+    data = request.get_json(silent=True) or {}
+    fields = {key: data[key] for key in ('email', 'name', 'location', 'phone_number') if key in data}
+    if not fields.get('email') or not fields.get('name'):
+        return jsonify({'error': 'email and name are required'}), 400
+    try:
+        user, created = User.upsert_user(firebase_id, **fields)
+    except IntegrityError:
+        return jsonify({'error': 'Email already in use'}), 409
+    return jsonify(user.to_dict()), 201 if created else 200
+
 @main.route('/users/<firebase_id>', methods=['GET'])
 def get_user(firebase_id):
-    user = User.get_by_firebase_id(firebase_id)
-    if user:
-        return jsonify(user.to_dict())
-    return jsonify({'error': 'User not found'}), 404
+    version = User.get_version(firebase_id)
+    if version is None:
+        return jsonify({'error': 'User not found'}), 404
+    return conditional_json(version, lambda: to_dict(User.get_by_firebase_id(firebase_id)), 'User not found')
 
 # Farm routes
 @main.route('/farms', methods=['POST'])
 def create_farm():
     data = request.get_json()
+    latitude = longitude = None
+    if 'latitude' in data or 'longitude' in data:
+        try:
+            latitude, longitude = parse_coordinates(data.get('latitude'), data.get('longitude'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     farm = Farm.create_farm(
-        name=data['name'],
-        location=data['location'],
-        owner_id=data['owner_id']
+        email=data['email'],
+        phone_number=data['phone_number'],
+        latitude=latitude,
+        longitude=longitude
     )
     return jsonify(farm.to_dict()), 201
 
+@main.route('/farms/nearby', methods=['GET'])
+def nearby_farms():
+    args = request.args
+    try:
+        latitude, longitude = parse_coordinates(args.get('lat'), args.get('lon'))
+        radius = parse_arg(args, 'radius', float, 25)
+        limit = parse_arg(args, 'limit', int, 20)
+        variety_id = parse_arg(args, 'variety_id', int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not 0 < radius <= MAX_RADIUS_KM:
+        return jsonify({'error': 'radius must be between 0 and %d km' % MAX_RADIUS_KM}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    nearest = Farm.nearby(latitude, longitude, radius, variety_id, min(limit, MAX_PAGE_SIZE))
+    items = Farm.to_detail_dicts([farm for farm, _ in nearest])
+    for item, (_, distance) in zip(items, nearest):
+        item['distance_km'] = round(distance, 3)
+    return jsonify({'items': items})
+
+@main.route('/farms', methods=['GET'])
+def list_farms():
+    try:
+        if 'ids' in request.args:
+            ids = batch_ids(request.args['ids'])
+            return batch_response(ids, Farm.get_details(ids))
+        after_id, limit = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return stream_page(page_query(Farm.id, after_id, limit).yield_per(STREAM_BATCH_SIZE), Farm.to_detail_dicts, limit)
+
 @main.route('/farms/<int:farm_id>', methods=['GET'])
 def get_farm(farm_id):
-    farm = Farm.get_by_id(farm_id)
-    if farm:
-        return jsonify(farm.to_dict())
-    return jsonify({'error': 'Farm not found'}), 404
+    version = Farm.get_version(farm_id)
+    if version is None:
+        return jsonify({'error': 'Farm not found'}), 404
+    return conditional_json(version, lambda: Farm.get_detail(farm_id), 'Farm not found')
+
+@main.route('/farms/<int:farm_id>', methods=['DELETE'])
+def delete_farm(farm_id):
+    try:
+        deleted = Farm.delete_farm(farm_id, archive=archive_requested())
+    except IntegrityError:
+        return jsonify({'error': 'An archived copy already holds a key of this farm'}), 409
+    if not deleted:
+        return jsonify({'error': 'Farm not found'}), 404
+    return '', 204
+
+@main.route('/farms/<int:farm_id>/restore', methods=['POST'])
+def restore_farm(farm_id):
+    try:
+        farm = Farm.restore_farm(farm_id)
+    except IntegrityError:
+        return jsonify({'error': 'Farm ID or email is taken by another farm'}), 409
+    if farm is None:
+        return jsonify({'error': 'Archived farm not found'}), 404
+    return jsonify(Farm.to_detail_dicts([farm])[0])
+
+@main.route('/farms/<int:farm_id>/inventory', methods=['GET'])
+def get_farm_inventory(farm_id):
+    if Farm.get_by_id(farm_id) is None:
+        return jsonify({'error': 'Farm not found'}), 404
+    items = Inventory.query.filter_by(farm_id=farm_id).order_by(Inventory.id).yield_per(STREAM_BATCH_SIZE)
+    return stream_page(items, Inventory.to_dicts)
+
+@main.route('/farms/<int:farm_id>/varieties', methods=['PUT'])
+def set_farm_varieties(farm_id):
+    data = request.get_json(silent=True) or {}
+    variety_ids = data.get('variety_ids')
+    if not isinstance(variety_ids, list) or not all(
+            isinstance(variety_id, int) and not isinstance(variety_id, bool) for variety_id in variety_ids):
+        return jsonify({'error': 'variety_ids must be a list of integers'}), 400
+    try:
+        result = Farm.set_varieties(farm_id, variety_ids)
+    except UnknownVarieties as e:
+        return jsonify({'error': str(e), 'variety_ids': e.variety_ids}), 400
+    if result is None:
+        return jsonify({'error': 'Farm not found'}), 404
+    added, removed = result
+    return jsonify({'variety_ids': sorted(set(variety_ids)), 'added': added, 'removed': removed})
 
 # Variety routes
 @main.route('/varieties', methods=['POST'])
 def create_variety():
     data = request.get_json()
-    variety = Variety.create_variety(
-        name=data['name'],
-        description=data.get('description')
-    )
+    variety = Variety.create_variety(name=data['name'])
     return jsonify(variety.to_dict()), 201
 
+@main.route('/varieties', methods=['GET'])
+def list_varieties():
+    try:
+        if 'ids' in request.args:
+            ids = batch_ids(request.args['ids'])
+            return batch_response(ids, Variety.get_cached_dicts(ids))
+        after_id, limit = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return stream_page(page_query(Variety.id, after_id, limit).yield_per(STREAM_BATCH_SIZE), to_dicts, limit)
+
+@main.route('/varieties/suggest', methods=['GET'])
+def suggest_varieties():
+    limit = request.args.get('limit', 10, type=int)
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+    return jsonify({'items': Variety.suggest(request.args.get('q', ''), min(limit, MAX_SUGGESTIONS))})
+
+@main.route('/varieties/stats', methods=['GET'])
+def list_variety_stats():
+    try:
+        after_id, limit = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    rows = page_query(VarietyStats.variety_id, after_id, limit).yield_per(STREAM_BATCH_SIZE)
+    return stream_page(rows, to_dicts, limit, key=lambda stats: stats.variety_id)
+
+@main.route('/varieties/<int:variety_id>/stats', methods=['GET'])
+def get_variety_stats(variety_id):
+    if Variety.get_by_id(variety_id) is None:
+        return jsonify({'error': 'Variety not found'}), 404
+    return jsonify(VarietyStats.get_for_variety(variety_id))
+
 @main.route('/varieties/<int:variety_id>', methods=['GET'])
 def get_variety(variety_id):
-    variety = Variety.get_by_id(variety_id)
-    if variety:
-        return jsonify(variety.to_dict())
-    return jsonify({'error': 'Variety not found'}), 404
+    version = Variety.get_version(variety_id)
+    if version is None:
+        return jsonify({'error': 'Variety not found'}), 404
+    return conditional_json(version, lambda: Variety.get_cached_dict(variety_id), 'Variety not found')
+
+@main.route('/varieties/<int:variety_id>', methods=['DELETE'])
+def delete_variety(variety_id):
+    try:
+        deleted = Variety.delete_variety(variety_id, archive=archive_requested())
+    except IntegrityError:
+        return jsonify({'error': 'An archived copy already holds a key of this variety'}), 409
+    if not deleted:
+        return jsonify({'error': 'Variety not found'}), 404
+    return '', 204
+
+@main.route('/varieties/<int:variety_id>/restore', methods=['POST'])
+def restore_variety(variety_id):
+    try:
+        variety = Variety.restore_variety(variety_id)
+    except IntegrityError:
+        return jsonify({'error': 'Variety ID or name is taken by another variety'}), 409
+    if variety is None:
+        return jsonify({'error': 'Archived variety not found'}), 404
+    return jsonify(variety.to_dict())
 
 # Inventory routes
 @main.route('/inventory', methods=['POST'])
 def create_inventory():
     data = request.get_json()
-    inventory = Inventory.create_inventory(
+    inventory = Inventory.create_inventory_item(
         farm_id=data['farm_id'],
         variety_id=data['variety_id'],
-        count=data['count'],
-        price=data['price']
+        price=data['price'],
+        count=data.get('count', 0)
     )
     return jsonify(inventory.to_dict()), 201
 
+@main.route('/inventory', methods=['GET'])
+def list_inventory():
+    try:
+        after_id, limit = page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return stream_page(page_query(Inventory.id, after_id, limit).yield_per(STREAM_BATCH_SIZE), Inventory.to_dicts, limit)
+
+@main.route('/inventory/search', methods=['GET'])
+def search_inventory():
+    args = request.args
+    variety_id = args.get('variety_id', type=int)
+    if variety_id is None and args.get('variety'):
+        variety = Variety.get_by_name(args['variety'])
+        if variety is None:
+            return jsonify({'items': []})
+        variety_id = variety.id
+    if variety_id is None:
+        return jsonify({'error': 'variety_id or variety is required'}), 400
+    limit = args.get('limit', 50, type=int)
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    items = Inventory.search(
+        variety_id,
+        min_price=args.get('min_price', type=float),
+        max_price=args.get('max_price', type=float),
+        min_count=args.get('min_count', 0, type=int),
+        limit=min(limit, MAX_PAGE_SIZE)
+    )
+    return jsonify({'items': [item.to_dict() for item in items]})
+
 @main.route('/inventory/<int:inventory_id>', methods=['GET'])
 def get_inventory(inventory_id):
-    inventory = Inventory.get_by_id(inventory_id)
-    if inventory:
-        return jsonify(inventory.to_dict())
-    return jsonify({'error': 'Inventory not found'}), 404 
\ No newline at end of file
+    version = Inventory.get_version(inventory_id)
+    if version is None:
+        return jsonify({'error': 'Inventory not found'}), 404
+    return conditional_json(version, lambda: to_dict(Inventory.get_by_id(inventory_id)), 'Inventory not found')
+
+@main.route('/inventory/<int:inventory_id>/history', methods=['GET'])
+def get_inventory_history(inventory_id):
+    item = Inventory.get_by_id(inventory_id)
+    if item is None:
+        return jsonify({'error': 'Inventory not found'}), 404
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return jsonify({'error': 'bucket must be one of %s' % ', '.join(BUCKETS)}), 400
+    try:
+        end = parse_timestamp(request.args['to']) if 'to' in request.args else None
+        start, end = PriceRollup.default_range(bucket, end)
+        if 'from' in request.args:
+            start = parse_timestamp(request.args['from'])
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO 8601 timestamps'}), 400
+    points = PriceRollup.series(item.farm_id, item.variety_id, bucket, start, end)
+    return jsonify({
+        'inventory_id': item.id,
+        'bucket': bucket,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'points': to_dicts(points)
+    })
+
+@main.route('/inventory/stream', methods=['GET'])
+@read_primary
+def stream_inventory_changes():
+    feed = current_app.extensions.get('change_feed')
+    if feed is None:
+        return jsonify({'error': 'Change feed is disabled'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    return feed.stream(request.args.get('farm_id', type=int), last_event_id)
+
+@main.route('/inventory/bulk', methods=['POST'])
+def bulk_upsert_inventory():
+    started = time.perf_counter()
+    report = {'processed': 0, 'upserted': 0, 'error_count': 0, 'errors': []}
+    chunk = []
+
+    def record_error(line, error):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': error})
+
+    def flush():
+        upserted, errors = Inventory.bulk_upsert(chunk)
+        report['upserted'] += upserted
+        for line, error in errors:
+            record_error(line, error)
+        chunk.clear()
+
+    for line, row, error in iter_rows(request.stream, request.mimetype):
+        report['processed'] += 1
+        if error is None:
+            try:
+                chunk.append((line, parse_inventory_row(row)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            record_error(line, error)
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['processed'] / elapsed) if elapsed else None
+    return jsonify(report)
+
+@main.route('/inventory/reserve', methods=['POST'])
+def reserve_inventory():
+    data = request.get_json()
+    try:
+        quantities = [(int(item['inventory_id']), int(item['quantity'])) for item in data['items']]
+        remaining = Inventory.reserve_items(quantities)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid reservation'}), 400
+    except InsufficientStock as e:
+        return jsonify({'error': str(e), 'inventory_id': e.inventory_id}), 409
+    return jsonify({'remaining': [
+        {'inventory_id': inventory_id, 'count': count}
+        for inventory_id, count in remaining.items()
+    ]})
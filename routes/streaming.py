@@ -0,0 +1,44 @@
+import itertools
+from flask import Response, current_app, stream_with_context
+from routes.pagination import encode_cursor
+
+STREAM_BATCH_SIZE = 500
+
+
+def batched(rows, size):
+    """Group an iterable into lists of at most size items"""
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_page(rows, serialize, limit=None, batch_size=STREAM_BATCH_SIZE, key=lambda row: row.id):
+    """Stream {"items": [...], "next_cursor": ...} while rows are still being fetched
+
+    rows should be a yield_per query ordered by key; serialize turns a batch
+    of rows into dicts. With a limit, rows may hold one extra row, which is
+    not sent but signals that another page exists.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{"items":['
+        sent = 0
+        last_id = None
+        has_more = False
+        for batch in batched(rows, batch_size):
+            if limit is not None and sent + len(batch) > limit:
+                batch = batch[:limit - sent]
+                has_more = True
+            if batch:
+                yield (',' if sent else '') + ','.join(dumps(item) for item in serialize(batch))
+                sent += len(batch)
+                last_id = key(batch[-1])
+            if has_more:
+                break
+        yield '],"next_cursor":%s}' % dumps(encode_cursor(last_id) if has_more else None)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
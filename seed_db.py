@@ -0,0 +1,250 @@
+import argparse
+import itertools
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from faker import Faker
+from sqlalchemy import func, insert, select
+from app import create_app
+from config import Config
+from models import db, User, Farm, Variety, Inventory, VarietyStats, PriceHistory, PriceRollup
+from models.base import farm_variety
+from models import geo
+from models.cache import variety_cache
+from models.price_history import BUCKETS
+
+CHUNK_SIZE = 10000
+
+
+def insert_chunked(table, rows):
+    """Insert an iterable of row dicts in executemany chunks
+
+    SQLite rows go straight to the driver as tuples, skipping SQLAlchemy's
+    per-row bind processing; other databases use its batched multi-VALUES
+    INSERTs, which are already fast there.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        execute = _sqlite_executemany(connection, table)
+    else:
+        def execute(chunk):
+            connection.execute(insert(table), chunk)
+
+    chunk = []
+    inserted = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            execute(chunk)
+            inserted += len(chunk)
+            chunk = []
+    if chunk:
+        execute(chunk)
+        inserted += len(chunk)
+    return inserted
+
+
+def _sqlite_executemany(connection, table):
+    cursor = connection.connection.cursor()
+    state = {}
+
+    def execute(chunk):
+        if not state:
+            columns = list(chunk[0])
+            state['sql'] = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                table.name, ', '.join(columns), ', '.join('?' * len(columns)))
+            state['columns'] = columns
+            state['dates'] = [isinstance(table.c[column].type, db.DateTime) for column in columns]
+        columns, dates = state['columns'], state['dates']
+        cursor.executemany(state['sql'], [
+            tuple(_sqlite_datetime(row[column]) if is_date and row[column] else row[column]
+                  for column, is_date in zip(columns, dates))
+            for row in chunk
+        ])
+
+    return execute
+
+
+def _sqlite_datetime(value):
+    # The storage format SQLAlchemy's SQLite DateTime type reads back
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def new_ids(model, after_id):
+    """Get the IDs inserted after after_id, in order"""
+    return list(db.session.scalars(select(model.id).where(model.id > after_id).order_by(model.id)))
+
+
+def max_id(model):
+    return db.session.execute(select(func.max(model.id))).scalar() or 0
+
+
+def seed(users, farms, varieties, varieties_per_farm, seed_value):
+    """Generate users, farms, varieties, farm varieties and inventory with bulk inserts
+
+    Variety popularity follows a Zipf-like curve, so a few varieties are
+    grown by most farms and a long tail by a handful. About one in five
+    listings is out of stock. The same seed always produces the same data.
+    """
+    rng = random.Random(seed_value)
+    fake = Faker()
+    fake.seed_instance(seed_value)
+    now = datetime.utcnow()
+    counts = {}
+
+    start = max_id(User)
+    counts['users'] = insert_chunked(User.__table__, (
+        {
+            'firebase_id': 'seed-%d-%d' % (seed_value, start + i),
+            'email': 'user%d.%d@%s' % (seed_value, start + i, fake.free_email_domain()),
+            'name': fake.name(),
+            'location': fake.city() if rng.random() < 0.7 else None,
+            'phone_number': fake.numerify('###-###-####') if rng.random() < 0.5 else None,
+            'created_at': now,
+            'updated_at': now
+        }
+        for i in range(users)
+    ))
+
+    # Farms cluster around growing regions; a separate generator keeps the rest of the data unchanged
+    places = random.Random(seed_value + 1)
+    regions = [(places.uniform(-40, 60), places.uniform(-125, 145)) for _ in range(50)]
+
+    def located(row):
+        latitude, longitude = places.choice(regions)
+        latitude = max(-90.0, min(90.0, latitude + places.gauss(0, 0.7)))
+        longitude = (longitude + places.gauss(0, 0.7) + 180) % 360 - 180
+        row.update(latitude=latitude, longitude=longitude, geohash=geo.encode(latitude, longitude))
+        return row
+
+    start = max_id(Farm)
+    insert_chunked(Farm.__table__, (
+        located({
+            'email': 'farm%d.%d@%s' % (seed_value, start + i, fake.free_email_domain()),
+            'phone_number': fake.numerify('###-###-####'),
+            'created_at': now,
+            'updated_at': now
+        })
+        for i in range(farms)
+    ))
+    farm_ids = new_ids(Farm, start)
+    counts['farms'] = len(farm_ids)
+
+    start = max_id(Variety)
+    insert_chunked(Variety.__table__, (
+        {
+            'name': '%s %s %d' % (fake.color_name(), fake.word().title(), start + i),
+            'created_at': now,
+            'updated_at': now
+        }
+        for i in range(varieties)
+    ))
+    variety_ids = new_ids(Variety, start)
+    counts['varieties'] = len(variety_ids)
+
+    if not variety_ids:
+        db.session.commit()
+        return counts
+
+    popularity = list(itertools.accumulate(1.0 / rank for rank in range(1, len(variety_ids) + 1)))
+    base_price = {variety_id: round(rng.lognormvariate(1.5, 0.6), 2) for variety_id in variety_ids}
+    grown = []
+    for farm_id in farm_ids:
+        wanted = min(len(variety_ids), max(1, int(rng.expovariate(1.0 / varieties_per_farm))))
+        chosen = set()
+        while len(chosen) < wanted:
+            chosen.update(rng.choices(variety_ids, cum_weights=popularity, k=wanted - len(chosen)))
+        grown.extend((farm_id, variety_id) for variety_id in sorted(chosen))
+
+    counts['farm_varieties'] = insert_chunked(farm_variety, (
+        {'farm_id': farm_id, 'variety_id': variety_id}
+        for farm_id, variety_id in grown
+    ))
+    counts['inventory'] = insert_chunked(Inventory.__table__, (
+        {
+            'farm_id': farm_id,
+            'variety_id': variety_id,
+            'price': round(base_price[variety_id] * rng.uniform(0.7, 1.4), 2),
+            'count': 0 if rng.random() < 0.2 else int(rng.paretovariate(1.2) * 10),
+            'created_at': now,
+            'updated_at': now
+        }
+        for farm_id, variety_id in grown
+        if rng.random() < 0.85
+    ))
+
+    # Raw inserts skip the incremental upkeep, so recompute the aggregates
+    VarietyStats.rebuild()
+    variety_cache.bump()
+    db.session.commit()
+    return counts
+
+
+def seed_price_history(days, seed_value):
+    """Give every listing one price change a day for the past days, with matching rollups
+
+    Prices take a random walk backwards from the listing's current price.
+    """
+    rng = random.Random()
+    now = datetime.utcnow()
+    listings = db.session.execute(select(Inventory.farm_id, Inventory.variety_id, Inventory.price, Inventory.count)).all()
+
+    def changes():
+        rng.seed(seed_value)
+        for farm_id, variety_id, price, count in listings:
+            walk = []
+            for day in range(1, days + 1):
+                price = round(max(0.1, price * rng.uniform(0.95, 1.05)), 2)
+                walk.append((price, (now - timedelta(days=day)).replace(hour=rng.randrange(24), minute=rng.randrange(60))))
+            for price, at in reversed(walk):
+                yield farm_id, variety_id, price, count, at
+
+    history = insert_chunked(PriceHistory.__table__, (
+        {'farm_id': farm_id, 'variety_id': variety_id, 'price': price, 'count': count, 'recorded_at': at}
+        for farm_id, variety_id, price, count, at in changes()
+    ))
+    # changes() reseeds, so the rollups replay the same walk
+    rolled = insert_chunked(PriceRollup.__table__, (
+        {
+            'farm_id': farm_id, 'variety_id': variety_id, 'bucket': bucket, 'bucket_start': start_of(at),
+            'min_price': price, 'max_price': price, 'last_price': price, 'last_count': count,
+            'last_at': at, 'samples': 1
+        }
+        for farm_id, variety_id, price, count, at in changes()
+        for bucket, start_of in BUCKETS.items()
+    ))
+    db.session.commit()
+    return {'price_history': history, 'price_rollups': rolled}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-load reproducible fake data')
+    parser.add_argument('--database-url', default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--farms', type=int, default=100)
+    parser.add_argument('--varieties', type=int, default=200)
+    parser.add_argument('--varieties-per-farm', type=float, default=20)
+    parser.add_argument('--history-days', type=int, default=0, help='Also generate this many days of price history')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    class SeedConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        started = time.perf_counter()
+        counts = seed(args.users, args.farms, args.varieties, args.varieties_per_farm, args.seed)
+        if args.history_days:
+            counts.update(seed_price_history(args.history_days, args.seed))
+        elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print("%-15s %d" % (table, count))
+    print("Inserted %d rows in %.2fs (%d rows/s)" % (total, elapsed, total / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import threading
+from flask import current_app, jsonify
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one execution of a function
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait up to timeout seconds for its result or exception. A waiter
+    that times out runs the function itself rather than failing.
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.max_waiters = 0
+
+    def do(self, key, fn):
+        """Return fn(), or the result of an identical call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn()
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            # Forget the call before waking waiters so later callers start afresh
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'max_waiters': self.max_waiters
+            }
+
+
+def init_app(app):
+    """Coalesce identical concurrent reads when SINGLE_FLIGHT is set; counters at /metrics/single-flight"""
+    if not app.config['SINGLE_FLIGHT']:
+        return
+    app.extensions['single_flight'] = SingleFlight(app.config['SINGLE_FLIGHT_TIMEOUT'])
+    app.add_url_rule('/metrics/single-flight', 'single_flight_metrics', single_flight_metrics_view)
+
+
+def single_flight_metrics_view():
+    return jsonify(current_app.extensions['single_flight'].to_dict())
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import event
+from app import create_app
+from config import Config
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on a fresh SQLite file, with its tables created and a context pushed"""
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'test.db')
+        DATABASE_REPLICA_URLS = []
+        FIREBASE_AUTH = False
+        SQL_PROFILING = False
+        CHANGE_FEED = 'memory'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        # Replica apps leave their bind keys on the shared db, with no tables of their own
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    """A list of every SQL statement the primary engine runs during the test"""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(db.engine, 'after_cursor_execute', record)
+    yield seen
+    event.remove(db.engine, 'after_cursor_execute', record)
@@ -0,0 +1,71 @@
+from models import db, Farm, Variety, Inventory
+
+
+def create_farm(client, email):
+    response = client.post('/farms', json={'email': email, 'phone_number': '555-0100'})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def create_variety(client, name):
+    response = client.post('/varieties', json={'name': name})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_archived_ids_are_not_handed_out_again(client):
+    create_farm(client, 'first@example.com')
+    farm_id = create_farm(client, 'second@example.com')
+    create_variety(client, 'Brandywine')
+    variety_id = create_variety(client, 'Sungold')
+    inventory_id = Inventory.create_inventory_item(farm_id, variety_id, 2.5, 5).id
+
+    assert client.delete('/varieties/%d?archive=true' % variety_id).status_code == 204
+    assert client.delete('/farms/%d?archive=true' % farm_id).status_code == 204
+
+    # SQLite would otherwise reuse the highest ID once its row is gone
+    assert create_farm(client, 'third@example.com') > farm_id
+    new_variety_id = create_variety(client, 'Green Zebra')
+    assert new_variety_id > variety_id
+    assert Inventory.create_inventory_item(1, new_variety_id, 2.5, 5).id > inventory_id
+
+    assert client.post('/varieties/%d/restore' % variety_id).status_code == 200
+    assert client.post('/farms/%d/restore' % farm_id).status_code == 200
+    assert db.session.get(Inventory, inventory_id).farm_id == farm_id
+
+
+def test_restore_into_a_taken_farm_id_or_email_conflicts(client):
+    farm_id = create_farm(client, 'farm@example.com')
+    assert client.delete('/farms/%d?archive=true' % farm_id).status_code == 204
+
+    # The email is taken by a new farm
+    other_id = create_farm(client, 'farm@example.com')
+    response = client.post('/farms/%d/restore' % farm_id)
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'Farm ID or email is taken by another farm'}
+    assert client.delete('/farms/%d' % other_id).status_code == 204
+
+    # The ID is taken by a row written with an explicit ID
+    db.session.add(Farm(id=farm_id, email='explicit@example.com', phone_number='555-0100'))
+    db.session.commit()
+    assert client.post('/farms/%d/restore' % farm_id).status_code == 409
+    assert client.delete('/farms/%d' % farm_id).status_code == 204
+
+    # The archive survived both attempts
+    response = client.post('/farms/%d/restore' % farm_id)
+    assert response.status_code == 200
+    assert response.get_json()['email'] == 'farm@example.com'
+
+
+def test_restore_into_a_taken_variety_name_conflicts(client):
+    variety_id = create_variety(client, 'Sungold')
+    assert client.delete('/varieties/%d?archive=true' % variety_id).status_code == 204
+    other_id = create_variety(client, 'Sungold')
+
+    response = client.post('/varieties/%d/restore' % variety_id)
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'Variety ID or name is taken by another variety'}
+
+    assert client.delete('/varieties/%d' % other_id).status_code == 204
+    assert client.post('/varieties/%d/restore' % variety_id).get_json()['name'] == 'Sungold'
+    assert Variety.get_by_name('Sungold').id == variety_id
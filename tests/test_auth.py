@@ -0,0 +1,114 @@
+import time
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+import auth
+from auth import StaticKeySource
+
+PROJECT_ID = 'demo-project'
+
+
+class CountingKeySource(StaticKeySource):
+    def __init__(self, jwks, **kwargs):
+        super().__init__(jwks, **kwargs)
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return super().fetch()
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    return private_key, dict(jwk, kid=kid, alg='RS256', use='sig')
+
+
+@pytest.fixture(scope='module')
+def signing_keys():
+    return {kid: make_key(kid) for kid in ('current', 'rotated')}
+
+
+@pytest.fixture
+def secured(app, signing_keys):
+    """A client for the app with Firebase auth on, and the key source it trusts"""
+    keys = CountingKeySource({'keys': [signing_keys['current'][1]]}, min_refresh_interval=60)
+    app.config.update(FIREBASE_AUTH=True, FIREBASE_PROJECT_ID=PROJECT_ID)
+    auth.init_app(app, 'main', keys=keys)
+    return app.test_client(), keys
+
+
+@pytest.fixture
+def token(signing_keys):
+    def make(kid='current', **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://securetoken.google.com/%s' % PROJECT_ID, 'aud': PROJECT_ID,
+                   'sub': 'user-1', 'iat': now, 'exp': now + 3600, 'auth_time': now}
+        payload.update(claims)
+        return jwt.encode(payload, signing_keys[kid][0], algorithm='RS256', headers={'kid': kid})
+
+    return make
+
+
+def get(client, token=None):
+    headers = {'Authorization': 'Bearer %s' % token} if token else {}
+    return client.get('/varieties', headers=headers)
+
+
+def test_valid_token(secured, token):
+    client, _ = secured
+    assert get(client, token()).status_code == 200
+
+
+def test_missing_bearer_token(secured, token):
+    client, _ = secured
+    response = get(client)
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Missing bearer token'}
+    assert response.headers['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+    response = client.get('/varieties', headers={'Authorization': 'Basic %s' % token()})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('claims', [
+    {'aud': 'other-project'},
+    {'iss': 'https://securetoken.google.com/other-project'},
+    {'exp': int(time.time()) - 60},
+    {'iat': int(time.time()) + 600},
+    {'auth_time': int(time.time()) + 600},
+])
+def test_rejected_claims(secured, token, claims):
+    client, _ = secured
+    assert get(client, token(**claims)).status_code == 401
+
+
+def test_unknown_key_id_refetches_at_most_once_per_interval(secured, token, signing_keys):
+    client, keys = secured
+    assert get(client, token()).status_code == 200
+    assert keys.fetches == 1
+
+    # The keys rotate; until the interval passes, the new kid is not fetched for
+    keys.jwks = {'keys': [signing_keys['current'][1], signing_keys['rotated'][1]]}
+    for _ in range(3):
+        assert get(client, token('rotated')).status_code == 401
+    assert keys.fetches == 1
+
+    keys._fetched_at -= keys.min_refresh_interval
+    assert get(client, token('rotated')).status_code == 200
+    assert keys.fetches == 2
+
+
+def test_unavailable_keys_return_503(app, token):
+    class FailingKeySource(StaticKeySource):
+        def fetch(self):
+            raise OSError('connection refused')
+
+    app.config.update(FIREBASE_AUTH=True, FIREBASE_PROJECT_ID=PROJECT_ID)
+    auth.init_app(app, 'main', keys=FailingKeySource({}))
+    assert get(app.test_client(), token()).status_code == 503
+
+
+def test_malformed_key_set_returns_503(app, token):
+    app.config.update(FIREBASE_AUTH=True, FIREBASE_PROJECT_ID=PROJECT_ID)
+    auth.init_app(app, 'main', keys=StaticKeySource({'keys': [{'kid': 'current', 'kty': 'RSA'}]}))
+    assert get(app.test_client(), token()).status_code == 503
@@ -0,0 +1,82 @@
+import json
+import pytest
+from flask import current_app
+from models import db, Farm
+from models.change_event import stage_change
+
+
+@pytest.fixture
+def feed(app):
+    feed = current_app.extensions['change_feed']
+    feed.heartbeat = 0.05
+    return feed
+
+
+def open_stream(client, **headers):
+    response = client.get('/inventory/stream', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response, iter(response.response)
+
+
+def read_events(chunks, count):
+    """Read chunks until count events arrived, as (id, kind, data) tuples"""
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(b'id: '):
+            lines = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+            events.append((int(lines['id']), lines['event'], json.loads(lines['data'])))
+            if len(events) == count:
+                break
+    return events
+
+
+def test_resume_replays_events_after_last_event_id(client, feed):
+    farm_ids = [Farm.create_farm('farm%d@example.com' % index, '555-0100').id for index in range(3)]
+
+    response, chunks = open_stream(client, **{'Last-Event-ID': '1'})
+    assert next(chunks) == b'retry: 3000\n\n'
+    assert read_events(chunks, 2) == [
+        (2, 'farm', {'farm_id': farm_ids[1], 'action': 'created'}),
+        (3, 'farm', {'farm_id': farm_ids[2], 'action': 'created'})
+    ]
+
+    # Then it follows live changes
+    farm_id = Farm.create_farm('farm3@example.com', '555-0100').id
+    assert read_events(chunks, 1) == [(4, 'farm', {'farm_id': farm_id, 'action': 'created'})]
+    response.close()
+
+
+def test_resume_from_unknown_position_resets(client, feed):
+    Farm.create_farm('farm@example.com', '555-0100')
+    response, chunks = open_stream(client, **{'Last-Event-ID': '99'})
+    assert b''.join(chunks) == b'retry: 3000\n\nevent: reset\ndata: {}\n\n'
+    response.close()
+
+
+def test_disconnect_unsubscribes(client, feed):
+    response, chunks = open_stream(client)
+    next(chunks)
+    assert feed.hub.to_dict()['subscribers'] == 1
+    response.close()
+    assert feed.hub.to_dict()['subscribers'] == 0
+
+
+def test_rolled_back_savepoint_publishes_nothing(client, feed):
+    farm_id = Farm.create_farm('farm@example.com', '555-0100').id
+    response, chunks = open_stream(client)
+    next(chunks)
+
+    stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'updated'})
+    with pytest.raises(RuntimeError):
+        with db.session.begin_nested():
+            stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'ghost'})
+            raise RuntimeError()
+    with db.session.begin_nested():
+        stage_change('farm', farm_id, {'farm_id': farm_id, 'action': 'varieties'})
+    db.session.commit()
+    Farm.create_farm('other@example.com', '555-0100')
+
+    actions = [data['action'] for _, _, data in read_events(chunks, 3)]
+    assert actions == ['updated', 'varieties', 'created']
+    response.close()
@@ -0,0 +1,39 @@
+from sqlalchemy import insert
+from models import db, Farm, Variety, Inventory
+from models.base import farm_variety
+from models.cache import variety_cache
+
+
+def make_farm(index, size):
+    """A farm listing size varieties of its own, with every second one linked as grown"""
+    farm = Farm.create_farm('farm%d@example.com' % index, '555-0100')
+    varieties = [Variety.create_variety('variety %d-%d' % (index, i)) for i in range(size)]
+    grown = [{'farm_id': farm.id, 'variety_id': v.id} for v in varieties[1::2]]
+    if grown:
+        db.session.execute(insert(farm_variety), grown)
+    db.session.execute(insert(Inventory.__table__), [
+        {'farm_id': farm.id, 'variety_id': v.id, 'price': 1.5, 'count': 3} for v in varieties
+    ])
+    db.session.commit()
+    return farm.id
+
+
+def test_farm_detail_query_count_stays_flat(client, statements):
+    farm_ids = {size: make_farm(index, size) for index, size in enumerate((1, 10, 200))}
+    # Warm up the variety cache's version check, which runs once per interval
+    client.get('/farms/%d' % farm_ids[1])
+
+    counts = {}
+    for size, farm_id in farm_ids.items():
+        # A cold cache and session, as on a worker that has not served these varieties yet
+        variety_cache.clear()
+        db.session.expunge_all()
+        del statements[:]
+        response = client.get('/farms/%d' % farm_id)
+        assert response.status_code == 200
+        assert len(response.json['inventory']) == size
+        assert len(response.json['varieties']) == size // 2
+        counts[size] = len(statements)
+
+    assert counts[1] == counts[10] == counts[200], counts
+    assert counts[200] <= 6
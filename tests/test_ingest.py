@@ -0,0 +1,42 @@
+import json
+from models import db, Farm, Variety, Inventory, VarietyStats
+
+
+def post_rows(client, rows):
+    body = '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+    return client.post('/inventory/bulk', data=body, content_type='application/x-ndjson')
+
+
+def test_bad_rows_are_reported_without_failing_the_upload(client):
+    farm_id = Farm.create_farm('farm@example.com', '555-0100').id
+    variety_ids = [Variety.create_variety(name).id for name in ('Roma', 'Sungold')]
+    too_big = 10 ** 23
+
+    response = post_rows(client, [
+        {'farm_id': farm_id, 'variety_id': variety_ids[0], 'price': 1, 'count': too_big},
+        {'farm_id': too_big, 'variety_id': variety_ids[0], 'price': 1},
+        '{"farm_id": %d, "variety_id": %d, "price": NaN}' % (farm_id, variety_ids[0]),
+        {'farm_id': farm_id, 'variety_id': variety_ids[1], 'price': 2.5, 'count': 4}
+    ])
+
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report['upserted'] == 1
+    assert [error['line'] for error in report['errors']] == [1, 2, 3]
+    assert Inventory.query.count() == 1
+    assert VarietyStats.verify() == []
+
+
+def test_bulk_upsert_isolates_values_the_column_cannot_hold(app):
+    farm_id = Farm.create_farm('farm@example.com', '555-0100').id
+    variety_ids = [Variety.create_variety(name).id for name in ('Roma', 'Sungold')]
+
+    upserted, errors = Inventory.bulk_upsert([
+        (1, {'farm_id': farm_id, 'variety_id': variety_ids[0], 'price': 1.0, 'count': 2 ** 63}),
+        (2, {'farm_id': farm_id, 'variety_id': variety_ids[1], 'price': 1.0, 'count': 3})
+    ])
+
+    assert upserted == 1
+    assert [line for line, _ in errors] == [1]
+    db.session.expire_all()
+    assert [item.variety_id for item in Inventory.query.all()] == [variety_ids[1]]
@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import event
+from models import db, Farm, Variety, Inventory
+
+
+@pytest.fixture
+def search_plan(app):
+    """Run Inventory.search and get SQLite's query plan for its inventory SELECT"""
+    farms = [Farm.create_farm('farm%d@example.com' % index, '555-0100') for index in range(5)]
+    varieties = [Variety.create_variety('Variety %d' % index) for index in range(5)]
+    for index, farm in enumerate(farms):
+        for variety in varieties:
+            Inventory.create_inventory_item(farm.id, variety.id, 1.0 + index, index)
+
+    def plan(**filters):
+        seen = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith('SELECT') and 'FROM inventory' in statement:
+                seen.append((statement, parameters))
+
+        event.listen(db.engine, 'after_cursor_execute', record)
+        try:
+            Inventory.search(varieties[0].id, **filters)
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', record)
+        assert len(seen) == 1
+        statement, parameters = seen[0]
+        with db.engine.connect() as connection:
+            rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+        return ' '.join(row[-1] for row in rows)
+
+    return plan
+
+
+def test_search_uses_variety_price_index(search_plan):
+    plan = search_plan(min_price=1.5, max_price=4.5)
+    assert 'USING INDEX ix_inventory_variety_price (' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_in_stock_search_uses_partial_index(search_plan):
+    plan = search_plan(max_price=4.5, min_count=2)
+    assert 'USING INDEX ix_inventory_variety_price_in_stock (' in plan
+    assert 'TEMP B-TREE' not in plan
@@ -0,0 +1,68 @@
+import threading
+import pytest
+from models import db, Farm, Variety, Inventory, InsufficientStock, VarietyStats
+
+THREADS = 16
+ATTEMPTS = 40
+STOCK = 500
+
+
+def make_item(email, name, count):
+    farm = Farm.get_by_email(email) or Farm.create_farm(email, '555-0100')
+    variety = Variety.create_variety(name)
+    return Inventory.create_inventory_item(farm.id, variety.id, 2.5, count).id
+
+
+def test_concurrent_decrements_never_oversell(app):
+    inventory_id = make_item('farm@example.com', 'Cherokee Purple', STOCK)
+    db.session.remove()
+    successes = []
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def order():
+        with app.app_context():
+            start.wait()
+            try:
+                succeeded = sum(Inventory.update_count(inventory_id, -1) for _ in range(ATTEMPTS))
+            except Exception as e:
+                errors.append(e)
+            else:
+                successes.append(succeeded)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=order) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sum(successes) == STOCK
+    assert db.session.get(Inventory, inventory_id).count == 0
+    assert VarietyStats.verify() == []
+
+
+def test_reservation_is_all_or_nothing(app):
+    plenty = make_item('farm@example.com', 'Brandywine', 5)
+    scarce = make_item('farm@example.com', 'Green Zebra', 1)
+
+    with pytest.raises(InsufficientStock) as raised:
+        Inventory.reserve_items([(plenty, 2), (scarce, 3)])
+
+    assert raised.value.inventory_id == scarce
+    db.session.expire_all()
+    assert (db.session.get(Inventory, plenty).count, db.session.get(Inventory, scarce).count) == (5, 1)
+    assert Inventory.reserve_items([(plenty, 2), (scarce, 1)]) == {plenty: 3, scarce: 0}
+    assert VarietyStats.verify() == []
+
+
+def test_update_without_changes_keeps_updated_at(app):
+    inventory_id = make_item('farm@example.com', 'Sungold', 3)
+    updated_at = db.session.get(Inventory, inventory_id).updated_at
+
+    Inventory.update_inventory_item(inventory_id, count=3)
+
+    db.session.expire_all()
+    assert db.session.get(Inventory, inventory_id).updated_at == updated_at
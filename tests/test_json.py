@@ -0,0 +1,28 @@
+import orjson
+from flask import jsonify
+from models import Variety
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+
+def test_jsonify_goes_through_orjson(app):
+    value = {'name': 'Pêche', 'price': 2.5, 'tags': ['b', 'a'], 'nested': {'z': 1, 'a': None}}
+
+    with app.test_request_context():
+        body = jsonify(value).get_data()
+
+    assert body == orjson.dumps(value, option=OPTIONS) + b'\n'
+
+
+def test_endpoints_serialize_a_variety_identically(client):
+    variety = Variety.create_variety('Pêche de Vigne')
+    expected = orjson.dumps(Variety.get_cached_dict(variety.id), option=OPTIONS)
+
+    single = client.get('/varieties/%d' % variety.id).get_data()
+    batch = client.get('/varieties?ids=%d' % variety.id).get_data()
+    listed = client.get('/varieties').get_data()
+
+    assert single == expected + b'\n'
+    assert expected in batch
+    assert expected in listed
+    assert client.get('/varieties/999').get_data() == orjson.dumps({'error': 'Variety not found'}) + b'\n'
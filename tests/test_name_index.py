@@ -0,0 +1,41 @@
+import threading
+from sqlalchemy import select
+from models import db, Variety
+from models.name_index import NameIndex
+
+
+def test_first_build_runs_once_while_other_callers_get_no_suggestions(app):
+    for name in ('Cherokee Purple', 'Cherry Bomb', 'Brandywine'):
+        Variety.create_variety(name)
+    building = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def query():
+        builds.append(1)
+        building.set()
+        assert release.wait(5)
+        return select(Variety.id, Variety.name)
+
+    index = NameIndex('test_names', query)
+    results = []
+
+    def first_caller():
+        with app.app_context():
+            results.append(index.suggest('cher'))
+            db.session.remove()
+
+    thread = threading.Thread(target=first_caller)
+    thread.start()
+    assert building.wait(5)
+    try:
+        assert index.suggest('cher') == []
+        assert builds == [1]
+    finally:
+        release.set()
+        thread.join()
+
+    names = ['Cherry Bomb', 'Cherokee Purple']
+    assert [name for _, name in results[0]] == names
+    assert [name for _, name in index.suggest('cher')] == names
+    assert builds == [1]
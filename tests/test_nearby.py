@@ -0,0 +1,61 @@
+import random
+import pytest
+from models import Farm, Variety, Inventory
+
+# Clusters around ordinary places, the antimeridian and a pole, where cells wrap
+CENTERS = [(37.77, -122.42), (51.5, -0.12), (-33.87, 151.21), (0.0, 179.9), (0.0, -179.9), (89.5, 10.0)]
+
+
+@pytest.fixture
+def farms(app):
+    rng = random.Random(3)
+    varieties = [Variety.create_variety('Variety %d' % index).id for index in range(3)]
+    for index in range(300):
+        latitude, longitude = rng.choice(CENTERS)
+        latitude = max(-90.0, min(90.0, latitude + rng.uniform(-1.5, 1.5)))
+        longitude = (longitude + rng.uniform(-1.5, 1.5) + 180) % 360 - 180
+        farm = Farm.create_farm('farm%d@example.com' % index, '555-0100', latitude, longitude)
+        Inventory.create_inventory_item(farm.id, rng.choice(varieties), 2.5, rng.choice([0, 5]))
+    Farm.create_farm('unlocated@example.com', '555-0100')
+    return rng, varieties
+
+
+def test_index_matches_a_full_scan(farms):
+    rng, varieties = farms
+    found = 0
+    for _ in range(60):
+        latitude, longitude = rng.choice(CENTERS)
+        latitude = max(-90.0, min(90.0, latitude + rng.uniform(-1, 1)))
+        longitude = (longitude + rng.uniform(-1, 1) + 180) % 360 - 180
+        radius = rng.choice([1, 10, 50, 150, 500])
+        variety_id = rng.choice([None] + varieties)
+        limit = rng.choice([5, 200])
+
+        def nearby(use_index):
+            nearest = Farm.nearby(latitude, longitude, radius, variety_id, limit, use_index=use_index)
+            return [(farm.id, distance) for farm, distance in nearest]
+
+        nearest = nearby(True)
+        assert nearest == nearby(False), (latitude, longitude, radius, variety_id, limit)
+        found += len(nearest)
+    assert found > 0
+
+
+@pytest.mark.parametrize('query', [
+    'lat=abc&lon=1', 'lat=1', 'lat=91&lon=0',
+    'lat=1&lon=1&radius=far', 'lat=1&lon=1&radius=0', 'lat=1&lon=1&radius=nan', 'lat=1&lon=1&radius=501',
+    'lat=1&lon=1&limit=ten', 'lat=1&lon=1&limit=0', 'lat=1&lon=1&variety_id=x'
+])
+def test_malformed_args_are_rejected(client, query):
+    response = client.get('/farms/nearby?' + query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_defaults_apply_to_missing_args(client, farms):
+    latitude, longitude = CENTERS[0]
+    response = client.get('/farms/nearby?lat=%s&lon=%s' % (latitude, longitude))
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert 0 < len(items) <= 20
+    assert all(item['distance_km'] <= 25 for item in items)
@@ -0,0 +1,114 @@
+import shutil
+import pytest
+from sqlalchemy import event, select, update
+from app import create_app
+from config import Config
+from models import db, Farm, Variety
+from models.cache import variety_cache
+from models.variety import variety_names
+from replicas import COOKIE, HEADER
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """The app on a primary SQLite file and a replica copied from it before later writes"""
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+
+    class ReplicaConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % primary
+        DATABASE_REPLICA_URLS = ['sqlite:///%s' % replica]
+        FIREBASE_AUTH = False
+        SQL_PROFILING = False
+        CHANGE_FEED = 'memory'
+
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        db.create_all(bind_key=None)
+        variety_id = Variety.create_variety('Stale Pink').id
+        farm_id = Farm.create_farm('farm@example.com', '555-0100').id
+        db.session.remove()
+        shutil.copyfile(primary, replica)
+        # The replica lags behind these
+        Farm.update_farm(farm_id, phone_number='555-0199')
+        Variety.update_variety(variety_id, name='Fresh Pink')
+        variety_cache.clear()
+        variety_names.configure(app.config['VARIETY_CACHE_VERSION_INTERVAL'])
+        db.session.remove()
+        yield app, farm_id, variety_id
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        variety_cache.clear()
+        variety_names.configure(app.config['VARIETY_CACHE_VERSION_INTERVAL'])
+
+
+@pytest.fixture
+def reads(replica_app):
+    """Which engine, 'primary' or 'replica', ran each SELECT"""
+    seen = []
+    listeners = []
+    for engine, name in ((db.engine, 'primary'), (db.engines['replica_0'], 'replica')):
+        def record(conn, cursor, statement, parameters, context, executemany, name=name):
+            if statement.lstrip().startswith('SELECT'):
+                seen.append(name)
+        event.listen(engine, 'after_cursor_execute', record)
+        listeners.append((engine, record))
+    yield seen
+    for engine, record in listeners:
+        event.remove(engine, 'after_cursor_execute', record)
+
+
+def phone_number(client, farm_id, **kwargs):
+    response = client.get('/farms/%d' % farm_id, **kwargs)
+    assert response.status_code == 200
+    return response.get_json()['phone_number']
+
+
+def test_get_reads_from_the_replica(replica_app, reads):
+    app, farm_id, _ = replica_app
+    client = app.test_client()
+    assert phone_number(client, farm_id) == '555-0100'
+    assert 'replica' in reads and 'primary' not in reads
+    assert client.get('/metrics/replicas').get_json()['replica_reads'] >= 1
+
+
+def test_write_pins_the_session_to_the_primary(replica_app, reads):
+    _, farm_id, _ = replica_app
+    db.session.info['replica'] = 'replica_0'
+    phone = select(Farm.phone_number).where(Farm.id == farm_id)
+    assert db.session.execute(phone).scalar() == '555-0100'
+    db.session.execute(update(Farm).where(Farm.id == farm_id).values(phone_number='555-0142'))
+    assert db.session.info['replica'] is None
+    assert db.session.execute(phone).scalar() == '555-0142'
+    assert reads == ['replica', 'primary']
+    db.session.rollback()
+
+
+def test_write_token_routes_the_next_read_to_the_primary(replica_app):
+    app, farm_id, variety_id = replica_app
+    client = app.test_client()
+    response = client.put('/farms/%d/varieties' % farm_id, json={'variety_ids': [variety_id]})
+    assert response.status_code == 200
+    until = response.headers[HEADER]
+    assert client.get_cookie(COOKIE).value == until
+
+    # The cookie comes back on its own; other clients can send the header instead
+    assert phone_number(client, farm_id) == '555-0199'
+    assert phone_number(app.test_client(), farm_id, headers={HEADER: until}) == '555-0199'
+    assert phone_number(app.test_client(), farm_id) == '555-0100'
+    # A deadline further out than the sticky window is ignored
+    assert phone_number(app.test_client(), farm_id, headers={HEADER: '%.3f' % (float(until) + 3600)}) == '555-0100'
+    assert app.test_client().get('/metrics/replicas').get_json()['sticky_reads'] == 2
+
+
+def test_variety_cache_fills_from_the_primary(replica_app):
+    app, _, variety_id = replica_app
+    assert app.test_client().get('/varieties/%d' % variety_id).get_json()['name'] == 'Fresh Pink'
+
+
+def test_name_index_builds_from_the_primary(replica_app):
+    app, _, _ = replica_app
+    client = app.test_client()
+    assert [item['name'] for item in client.get('/varieties/suggest?q=fresh').get_json()['items']] == ['Fresh Pink']
+    assert client.get('/varieties/suggest?q=stale').get_json()['items'] == []
@@ -0,0 +1,73 @@
+import threading
+import time
+import pytest
+from single_flight import SingleFlight
+
+CALLERS = 8
+
+
+def run_concurrently(flight, fn):
+    """Call flight.do from CALLERS threads, letting fn finish once every other caller waits on it"""
+    release = threading.Event()
+    outcomes = [None] * CALLERS
+
+    def leader_fn():
+        assert release.wait(5)
+        return fn()
+
+    def caller(index):
+        try:
+            outcomes[index] = ('result', flight.do('key', leader_fn))
+        except Exception as e:
+            outcomes[index] = ('error', e)
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.max_waiters < CALLERS - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_identical_calls_share_one_execution():
+    flight = SingleFlight(timeout=5)
+    calls = []
+
+    def build():
+        calls.append(1)
+        return object()
+
+    outcomes = run_concurrently(flight, build)
+
+    assert len(calls) == 1
+    assert len({id(value) for kind, value in outcomes}) == 1
+    assert all(kind == 'result' for kind, value in outcomes)
+    assert flight.to_dict() == {'in_flight': 0, 'leaders': 1, 'coalesced': CALLERS - 1,
+                                'timeouts': 0, 'errors': 0, 'max_waiters': CALLERS - 1}
+    # Later callers run the function again
+    assert flight.do('key', build) is not outcomes[0][1]
+    assert len(calls) == 2
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight(timeout=5)
+    calls = []
+
+    def build():
+        calls.append(1)
+        raise ValueError('database went away')
+
+    outcomes = run_concurrently(flight, build)
+
+    assert len(calls) == 1
+    assert [kind for kind, value in outcomes] == ['error'] * CALLERS
+    assert all(str(value) == 'database went away' for kind, value in outcomes)
+    assert flight.to_dict()['errors'] == 1
+    assert flight.to_dict()['coalesced'] == CALLERS - 1
+    with pytest.raises(ValueError):
+        flight.do('key', build)
+    assert len(calls) == 2
@@ -0,0 +1,56 @@
+import random
+from models import db, Farm, Variety, Inventory, VarietyStats
+
+STEPS = 300
+
+
+def test_incremental_stats_match_a_rebuild(app):
+    rng = random.Random(7)
+    farm_ids = [Farm.create_farm('farm%d@example.com' % index, '555-0100').id for index in range(4)]
+    variety_ids = [Variety.create_variety('Variety %d' % index).id for index in range(4)]
+    archived_farms, archived_varieties = [], []
+
+    def listings():
+        return [item.id for item in Inventory.query.order_by(Inventory.id)]
+
+    def price():
+        # Few distinct prices, so removals often take away a minimum or maximum
+        return rng.choice([1.0, 2.5, 4.0, 7.5, 10.0])
+
+    for step in range(STEPS):
+        action = rng.choice(['create', 'create', 'bulk', 'price', 'count', 'stock', 'delete',
+                             'archive_farm', 'restore_farm', 'archive_variety', 'restore_variety'])
+        items = listings()
+        if action == 'create':
+            farm_id, variety_id = rng.choice(farm_ids), rng.choice(variety_ids)
+            if Inventory.get_by_farm_and_variety(farm_id, variety_id) is None:
+                Inventory.create_inventory_item(farm_id, variety_id, price(), rng.randint(0, 20))
+        elif action == 'bulk':
+            rows = [(line, {'farm_id': rng.choice(farm_ids), 'variety_id': rng.choice(variety_ids),
+                            'price': price(), 'count': rng.randint(0, 20)}) for line in range(1, 6)]
+            Inventory.bulk_upsert(rows)
+        elif action == 'price' and items:
+            Inventory.update_inventory_item(rng.choice(items), price=price())
+        elif action == 'count' and items:
+            Inventory.update_inventory_item(rng.choice(items), count=rng.randint(0, 20))
+        elif action == 'stock' and items:
+            Inventory.update_count(rng.choice(items), rng.choice([-3, -1, 2, 5]))
+        elif action == 'delete' and items:
+            Inventory.delete_inventory_item(rng.choice(items))
+        elif action == 'archive_farm' and len(farm_ids) > 1:
+            farm_id = farm_ids.pop(rng.randrange(len(farm_ids)))
+            Farm.delete_farm(farm_id, archive=True)
+            archived_farms.append(farm_id)
+        elif action == 'restore_farm' and archived_farms:
+            farm_id = archived_farms.pop(rng.randrange(len(archived_farms)))
+            Farm.restore_farm(farm_id)
+            farm_ids.append(farm_id)
+        elif action == 'archive_variety' and len(variety_ids) > 1:
+            variety_id = variety_ids.pop(rng.randrange(len(variety_ids)))
+            Variety.delete_variety(variety_id, archive=True)
+            archived_varieties.append(variety_id)
+        elif action == 'restore_variety' and archived_varieties:
+            variety_id = archived_varieties.pop(rng.randrange(len(archived_varieties)))
+            Variety.restore_variety(variety_id)
+            variety_ids.append(variety_id)
+        assert VarietyStats.verify() == [], 'after step %d (%s)' % (step, action)